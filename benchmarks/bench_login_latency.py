@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from ..main import app
+from ..db.db_conn import get_async_session, get_read_session
+from ..db.categories import load_category_map
+from ..response_cache import response_cache
+from ..security.password import configure_password_pool, shutdown_password_pool
+from .common import percentile
+from .dataset import seed_dataset
+
+USER = {'firstname': 'Bench', 'lastname': 'User', 'email': 'bench@iceedge.io', 'password': 'password1234', 'password_confirm': 'password1234', 'address': 'G50, Balogun Gambari'}
+
+
+async def browse(client: httpx.AsyncClient, requests: int) -> list[float]:
+    latencies = []
+    for _ in range(requests):
+        # a cache hit never reaches the database, every page has to be read and encoded
+        response_cache.clear()
+        start = time.perf_counter()
+        res = await client.get('/products/', params={'limit': 20})
+        latencies.append((time.perf_counter() - start) * 1000)
+        if res.status_code != 200 or not res.json()['items']:
+            raise RuntimeError(f'GET /products/ returned {res.status_code} without products')
+    return latencies
+
+
+async def login_forever(transport: httpx.ASGITransport, stop: asyncio.Event) -> int:
+    logins = 0
+    while not stop.is_set():
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            res = await client.post('/user/login', data={'email': USER['email'], 'password': USER['password']})
+        if res.status_code != 200:
+            raise RuntimeError(f'POST /user/login returned {res.status_code}')
+        logins += 1
+    return logins
+
+
+async def run(requests: int, login_concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        res = await client.post('/user/register', json=USER)
+        if res.status_code != 200:
+            raise RuntimeError(f'POST /user/register returned {res.status_code}')
+        idle = await browse(client, requests)
+        stop = asyncio.Event()
+        login_tasks = [asyncio.create_task(login_forever(transport, stop)) for _ in range(login_concurrency)]
+        started = time.perf_counter()
+        loaded = await browse(client, requests)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        logins = sum(await asyncio.gather(*login_tasks))
+    return {
+        'idle': {'p50_ms': statistics.median(idle), 'p99_ms': percentile(idle, 99)},
+        'under_login_load': {'p50_ms': statistics.median(loaded), 'p99_ms': percentile(loaded, 99)},
+        'logins_per_second': logins / elapsed,
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    configure_password_pool(kind=args.pool, workers=args.workers, max_pending=args.max_pending)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        await seed_dataset(engine, users=0, products=args.products, purchases_per_user=0, seed=args.seed)
+        async with session_maker() as session:
+            await load_category_map(session)
+
+        async def get_bench_session():
+            async with session_maker() as session:
+                yield session
+
+        app.dependency_overrides[get_async_session] = get_bench_session
+        app.dependency_overrides[get_read_session] = get_bench_session
+        try:
+            result = await run(args.requests, args.login_concurrency)
+        finally:
+            app.dependency_overrides.pop(get_async_session, None)
+            app.dependency_overrides.pop(get_read_session, None)
+            shutdown_password_pool()
+            await engine.dispose()
+    return {'pool': args.pool, 'workers': args.workers, 'login_concurrency': args.login_concurrency, 'products': args.products, **result}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='p99 latency of GET /products while logins run concurrently')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--login-concurrency', type=int, default=8)
+    parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending', type=int, default=64)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,87 @@
+import argparse
+import itertools
+import json
+import random
+import sqlite3
+import statistics
+import time
+from ..db.search import PRODUCT_SEARCH_DDL, PRODUCT_SEARCH_REBUILD, match_expression
+
+SYLLABLES = ['ba', 'ko', 'ri', 'mu', 'te', 'sa', 'lo', 'ne', 'di', 'ga', 'zu', 'pe', 'fa', 'xi', 'vo', 'ha']
+VOCABULARY_SIZE = 20_000
+# ranks into the Zipf-distributed vocabulary: a common word, a mid-frequency word and a rare one
+QUERY_RANKS = [[10], [200], [5000], [10, 200], [50, 800, 3000]]
+
+FTS_QUERY = (
+    "SELECT p.id, bm25(products_fts, 10.0, 1.0) AS score FROM products_fts JOIN products p ON p.id = products_fts.rowid "
+    "WHERE products_fts MATCH ? ORDER BY score, p.id LIMIT ?"
+)
+
+
+def like_query(terms: list[str]) -> str:
+    clause = ' AND '.join('(name LIKE ? OR description LIKE ?)' for _ in terms)
+    return f"SELECT id FROM products WHERE {clause} ORDER BY created_at, id LIMIT ?"
+
+
+def vocabulary() -> list[str]:
+    words = []
+    for a in SYLLABLES:
+        for b in SYLLABLES:
+            for c in SYLLABLES:
+                for d in SYLLABLES:
+                    words.append(a + b + c + d)
+                    if len(words) == VOCABULARY_SIZE:
+                        return words
+    return words
+
+
+def seed(conn: sqlite3.Connection, rows: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    words = vocabulary()
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR(255) UNIQUE, description TEXT, created_at DATETIME)")
+    conn.executemany(
+        "INSERT INTO products (id, name, description, created_at) VALUES (?, ?, ?, datetime('now'))",
+        ((i, f"{' '.join(rng.choices(words, cum_weights=weights, k=3))} {i}", ' '.join(rng.choices(words, cum_weights=weights, k=25))) for i in range(1, rows + 1)),
+    )
+    for ddl in PRODUCT_SEARCH_DDL:
+        conn.execute(ddl)
+    conn.execute(PRODUCT_SEARCH_REBUILD)
+    conn.commit()
+    return words
+
+
+def timed(conn: sqlite3.Connection, sql: str, params: list, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run(rows: int, limit: int, repeat: int, seed_value: int) -> dict:
+    conn = sqlite3.connect(':memory:')
+    words = seed(conn, rows, seed_value)
+    results = {}
+    for ranks in QUERY_RANKS:
+        terms = [words[rank - 1] for rank in ranks]
+        query = ' '.join(terms)
+        like_params = [f'%{t}%' for t in terms for _ in range(2)]
+        results[query] = {
+            'fts_ms': timed(conn, FTS_QUERY, [match_expression(query), limit], repeat),
+            'like_ms': timed(conn, like_query(terms), [*like_params, limit], repeat),
+            'matches': conn.execute("SELECT count(*) FROM products_fts WHERE products_fts MATCH ?", [match_expression(query)]).fetchone()[0],
+        }
+    conn.close()
+    return {'rows': rows, 'limit': limit, 'queries': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare FTS5 product search against a LIKE scan')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.limit, args.repeat, args.seed), indent=2))
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import importlib
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from pydantic_core import to_json
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from ..db.model import Base, Category, Product
+from ..db.schema import Cat, ProductPage
+from ..serialization import orjson, rows_as_dicts
+
+# the routers only import cleanly once main has been loaded, as in load_test
+importlib.import_module('..main', __package__)
+from ..routers.product import select_product_rows
+
+
+async def seed(session_maker, rows: int, seed_value: int) -> None:
+    rng = random.Random(seed_value)
+    now = datetime.now()
+    async with session_maker() as session:
+        await session.execute(insert(Category), [{'id': i, 'name': cat} for i, cat in enumerate(Cat, 1)])
+        await session.execute(insert(Product), [
+            {
+                'id': i, 'name': f'Product {i}', 'description': 'A sturdy cotton shirt with a relaxed fit ' * 3,
+                'price': round(rng.uniform(3000, 120000), 2), 'discount': rng.choice((0, 5, 10)), 'cat_id': rng.randint(1, len(Cat)),
+                'thumbnail': f'https://cdn.iceedge.io/products/{i}.jpg', 'gallery': [f'https://cdn.iceedge.io/products/{i}-{j}.jpg' for j in range(3)],
+                'amt_left': rng.randint(1, 500), 'avg_rating': rng.uniform(1, 5), 'ratings_count': rng.randint(0, 300), 'created_at': now - timedelta(minutes=i),
+            }
+            for i in range(1, rows + 1)
+        ])
+        await session.commit()
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def timed_async(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def run(rows: int, repeat: int, seed_value: int) -> dict:
+    engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await seed(session_maker, rows, seed_value)
+
+    async with session_maker() as session:
+        async def fetch_orm():
+            session.expunge_all()
+            return (await session.scalars(select(Product).order_by(Product.created_at, Product.id))).all()
+
+        async def fetch_rows():
+            return rows_as_dicts((await session.execute(select_product_rows().order_by(Product.created_at, Product.id))).mappings())
+
+        fetch = {'orm_entities': await timed_async(fetch_orm, repeat), 'core_mappings': await timed_async(fetch_rows, repeat)}
+        page = {'items': await fetch_rows(), 'next_cursor': None}
+
+    encode = {
+        # what the list endpoints did before: validate every row, then dump
+        'pydantic_validate_and_dump': timed(lambda: ProductPage.model_validate(page).model_dump_json(), repeat),
+        'pydantic_dump_then_json_dumps': timed(lambda: json.dumps(ProductPage.model_validate(page).model_dump(mode='json')), repeat),
+        'pydantic_core_to_json': timed(lambda: to_json(page), repeat),
+    }
+    if orjson is not None:
+        encode['orjson'] = timed(lambda: orjson.dumps(page, option=orjson.OPT_NON_STR_KEYS), repeat)
+    await engine.dispose()
+
+    per_1k = 1000 / rows
+    return {
+        'rows': rows,
+        'fetch_ms_per_1k_rows': {name: round(ms * per_1k, 3) for name, ms in fetch.items()},
+        'encode_ms_per_1k_rows': {name: round(ms * per_1k, 3) for name, ms in encode.items()},
+        'encode_speedup_vs_pydantic': {name: round(encode['pydantic_validate_and_dump'] / ms, 1) for name, ms in encode.items()},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cost of turning product rows into a JSON list page')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.rows, args.repeat, args.seed)), indent=2))
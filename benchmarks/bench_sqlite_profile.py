@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from ..db.engine import STORAGE_PROFILES, make_engine
+
+ROWS = 10_000
+
+
+async def seed(engine) -> None:
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR(255), amt_left INTEGER, description TEXT)"))
+        await conn.execute(
+            text("INSERT INTO products (id, name, amt_left, description) VALUES (:id, :name, 100, :description)"),
+            [{'id': i, 'name': f'product {i}', 'description': 'x' * 200} for i in range(1, ROWS + 1)],
+        )
+
+
+async def worker(engine, rng: random.Random, write_ratio: float, deadline: float, counts: dict) -> None:
+    while time.perf_counter() < deadline:
+        product_id = rng.randint(1, ROWS)
+        try:
+            if rng.random() < write_ratio:
+                async with engine.begin() as conn:
+                    await conn.execute(text("UPDATE products SET amt_left = amt_left - 1 WHERE id = :id"), {'id': product_id})
+                counts['writes'] += 1
+            else:
+                async with engine.connect() as conn:
+                    await conn.execute(text("SELECT * FROM products WHERE id >= :id ORDER BY id LIMIT 20"), {'id': product_id})
+                counts['reads'] += 1
+        except OperationalError:
+            counts['errors'] += 1
+
+
+async def run_profile(profile: str, concurrency: int, duration: float, write_ratio: float, seed_value: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}", profile=profile, pool_size=concurrency, max_overflow=0)
+        await seed(engine)
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(worker(engine, random.Random(seed_value + i), write_ratio, deadline, counts) for i in range(concurrency)))
+        await engine.dispose()
+    return {
+        'reads_per_second': counts['reads'] / duration,
+        'writes_per_second': counts['writes'] / duration,
+        'locked_errors': counts['errors'],
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    results = {}
+    for profile in args.profiles:
+        results[profile] = await run_profile(profile, args.concurrency, args.duration, args.write_ratio, args.seed)
+    return {'concurrency': args.concurrency, 'duration_s': args.duration, 'write_ratio': args.write_ratio, 'profiles': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mixed read/write throughput with and without the SQLite storage profile')
+    parser.add_argument('--profiles', nargs='+', choices=sorted(STORAGE_PROFILES), default=['default', 'performance'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
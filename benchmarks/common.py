@@ -0,0 +1,37 @@
+import itertools
+import statistics
+from http.cookies import SimpleCookie
+import httpx
+
+CSRF_COOKIE_NAME = 'csrftoken'
+CSRF_HEADER_NAME = 'x-csrftoken'
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def latency_summary(samples: list[float]) -> dict:
+    if not samples:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None}
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+    }
+
+
+def zipf_cum_weights(n: int, exponent: float) -> list[float]:
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def keep_cookies(client: httpx.AsyncClient, response: httpx.Response) -> None:
+    # the app scopes its cookies to a domain and marks the session cookie secure,
+    # neither of which the in-process transport can satisfy, so keep them by name
+    for header in response.headers.get_list('set-cookie'):
+        for name, morsel in SimpleCookie(header).items():
+            client.cookies.set(name, morsel.value)
+            if name == CSRF_COOKIE_NAME:
+                client.headers[CSRF_HEADER_NAME] = morsel.value
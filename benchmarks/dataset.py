@@ -0,0 +1,77 @@
+import random
+from datetime import datetime, timedelta
+from typing import NamedTuple
+from uuid import UUID
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from ..db.model import Base, Category, User, Product, Order, OrderItem
+from ..db.schema import Cat, Role, OrderStatus
+from ..db.search import create_product_search
+from ..security.password import hash_password
+
+PASSWORD = 'password1234'
+INSERT_BATCH_SIZE = 5000
+
+
+class Dataset(NamedTuple):
+    password: str
+    emails: list[str]
+    product_ids: list[int]
+    purchases: dict[str, list[int]]
+
+
+def batched(rows: list[dict], size: int = INSERT_BATCH_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+async def seed_dataset(engine: AsyncEngine, users: int, products: int, purchases_per_user: int, seed: int = 42) -> Dataset:
+    rng = random.Random(seed)
+    now = datetime.now()
+    # hashing is deliberately slow, so every seeded user shares one hash
+    password_hash = hash_password(PASSWORD)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        if conn.dialect.name == 'sqlite':
+            await create_product_search(conn)
+        await conn.execute(insert(Category), [{'id': i, 'name': cat} for i, cat in enumerate(Cat, 1)])
+
+        product_rows = [
+            {
+                'id': i, 'name': f'Product {i}', 'description': f'Seeded product number {i} for load testing',
+                'price': round(rng.uniform(5000, 100000), 2), 'discount': 0, 'cat_id': rng.randint(1, len(Cat)),
+                'thumbnail': f'https://cdn.iceedge.io/products/{i}.jpg', 'gallery': [], 'amt_left': 10 ** 9,
+                'avg_rating': 0, 'ratings_count': 0, 'created_at': now - timedelta(minutes=products - i),
+            }
+            for i in range(1, products + 1)
+        ]
+        for rows in batched(product_rows):
+            await conn.execute(insert(Product), rows)
+
+        emails = [f'bench{i}@iceedge.io' for i in range(users)]
+        user_ids = [UUID(int=rng.getrandbits(128), version=4) for _ in range(users)]
+        user_rows = [
+            {'id': user_id, 'firstname': 'Bench', 'lastname': f'User{i}', 'role': Role.CUSTOMER, 'email': email, 'password': password_hash, 'address': 'G50, Balogun Gambari', 'created_at': now}
+            for i, (user_id, email) in enumerate(zip(user_ids, emails))
+        ]
+        for rows in batched(user_rows):
+            await conn.execute(insert(User), rows)
+
+        # one delivered order per user covering the products that user may review
+        purchases: dict[str, list[int]] = {}
+        order_rows, item_rows = [], []
+        for user_id, email in zip(user_ids, emails):
+            bought = rng.sample(range(1, products + 1), min(purchases_per_user, products))
+            purchases[email] = bought
+            order_id = UUID(int=rng.getrandbits(128), version=4)
+            prices = [product_rows[product_id - 1]['price'] for product_id in bought]
+            order_rows.append({
+                'id': order_id, 'total': sum(prices) * 2, 'quantity': 2 * len(bought), 'shipping_fee': 1500.0, 'status': OrderStatus.DELIVERED,
+                'shipping_address': 'G50, Balogun Gambari', 'created_at': now, 'customer_id': user_id,
+            })
+            item_rows += [{'unit_price': price, 'quantity': 2, 'product_id': product_id, 'created_at': now, 'order_id': order_id} for product_id, price in zip(bought, prices)]
+        for rows in batched(order_rows):
+            await conn.execute(insert(Order), rows)
+        for rows in batched(item_rows):
+            await conn.execute(insert(OrderItem), rows)
+    return Dataset(PASSWORD, emails, [row['id'] for row in product_rows], purchases)
@@ -0,0 +1,245 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+from uuid import UUID
+from sqlalchemy import create_engine, event, insert, Table
+from sqlalchemy.engine import Connection
+from ..db.model import Base, Category, User, Product, Review, Order, OrderItem, Cart, CartItem
+from ..db.schema import Cat, Role, OrderStatus
+from ..db.search import PRODUCT_SEARCH_DDL, PRODUCT_SEARCH_REBUILD
+from ..security.password import hash_password
+from .common import zipf_cum_weights
+
+PASSWORD = 'password1234'
+BATCH_SIZE = 50_000
+HISTORY_SECONDS = 365 * 24 * 3600
+# generated timestamps count back from a fixed instant, so a seed always yields the same rows
+DEFAULT_NOW = '2026-01-01T00:00:00'
+# safe only because a failed load is thrown away and regenerated
+BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'OFF',
+    'synchronous': 'OFF',
+    'locking_mode': 'EXCLUSIVE',
+    'temp_store': 'MEMORY',
+    'cache_size': '-262144',
+}
+REVIEW_TEXTS = [
+    'Fits well and the fabric holds up', 'Colour faded after a few washes', 'Exactly as pictured',
+    'Runs a size small', 'Great value for the price', 'Stitching came loose within a week',
+    'Comfortable enough to wear all day', 'Delivery was quick and the packaging was neat',
+]
+
+
+# values are generated in their stored form (ISO datetimes, hex uuids, enum names)
+# so batches can go straight to executemany without per-row bind processing
+def timestamp(dt: datetime) -> str:
+    return dt.isoformat(' ', 'microseconds')
+
+
+def new_uuid(rng: random.Random) -> str:
+    return UUID(int=rng.getrandbits(128), version=4).hex
+
+
+def bulk_insert(conn: Connection, table: Table, columns: list[str], rows: Iterable[tuple], batch_size: int = BATCH_SIZE) -> int:
+    compiled = insert(table).compile(dialect=conn.dialect, column_keys=columns)
+    order = [columns.index(name) for name in compiled.positiontup]
+    reorder = order != list(range(len(columns)))
+    inserted = 0
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, batch_size)):
+        if reorder:
+            batch = [tuple(row[i] for i in order) for row in batch]
+        conn.exec_driver_sql(str(compiled), batch)
+        inserted += len(batch)
+    return inserted
+
+
+class Generator:
+    def __init__(self, users: int, products: int, reviews: int, orders: int, carts: int, max_items: int, zipf: float, user_zipf: float, seed: int, now: datetime):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.products = products
+        self.reviews = reviews
+        self.orders = orders
+        self.carts = min(carts, users)
+        self.max_items = max_items
+        self.now = now.replace(microsecond=0)
+        # product popularity follows a Zipf law over a shuffled ranking, so ids carry no signal
+        self.ranked_products = list(range(1, products + 1))
+        self.rng.shuffle(self.ranked_products)
+        self.product_weights = zipf_cum_weights(products, zipf)
+        self.user_weights = zipf_cum_weights(users, user_zipf)
+        self.prices = [0.0] + [round(self.rng.uniform(3000, 120000), 2) for _ in range(products)]
+        self.user_ids = [new_uuid(self.rng) for _ in range(users)]
+
+    def popular_products(self, k: int) -> list[int]:
+        return self.rng.choices(self.ranked_products, cum_weights=self.product_weights, k=k)
+
+    def active_users(self, k: int) -> list[str]:
+        return self.rng.choices(self.user_ids, cum_weights=self.user_weights, k=k)
+
+    def moment(self) -> datetime:
+        return self.now - timedelta(seconds=self.rng.randrange(HISTORY_SECONDS))
+
+    def past(self) -> str:
+        return timestamp(self.moment())
+
+    def after(self, start: datetime) -> str:
+        return timestamp(start + timedelta(seconds=self.rng.randrange(max(int((self.now - start).total_seconds()), 1))))
+
+    def category_rows(self) -> Iterator[tuple]:
+        for i, cat in enumerate(Cat, 1):
+            yield (i, cat.name)
+
+    def review_rows(self, purchases: dict[tuple[str, int], datetime]) -> tuple[list[tuple], dict[int, list[float]]]:
+        rng = self.rng
+        if self.reviews > len(purchases):
+            raise ValueError(f'Only {len(purchases)} distinct purchases to review but {self.reviews} reviews were requested, raise --orders or lower --reviews')
+        rows: list[tuple] = []
+        ratings: dict[int, list[float]] = {}
+        # the API only takes reviews of purchased products, so reviewers are drawn from each product's buyers,
+        # one review per pair; popular products have more buyers and so collect more reviews
+        for user_id, product_id in rng.sample(list(purchases), self.reviews):
+            rating = float(rng.randint(1, 5))
+            stats = ratings.setdefault(product_id, [0.0, 0])
+            stats[0] += rating
+            stats[1] += 1
+            rows.append((len(rows) + 1, rng.choice(REVIEW_TEXTS), rating, rng.randrange(20) if rng.random() < 0.2 else 0, self.after(purchases[user_id, product_id]), product_id, user_id))
+        return rows, ratings
+
+    def product_rows(self, ratings: dict[int, list[float]]) -> Iterator[tuple]:
+        rng = self.rng
+        categories = len(Cat)
+        for product_id in range(1, self.products + 1):
+            total, count = ratings.get(product_id, (0.0, 0))
+            yield (
+                product_id, self.prices[product_id], rng.choice((0, 0, 0, 5, 10, 20)), f'Product {product_id}',
+                f'Seeded product number {product_id}', rng.randint(1, categories), f'https://cdn.iceedge.io/products/{product_id}.jpg',
+                json.dumps([f'https://cdn.iceedge.io/products/{product_id}-{i}.jpg' for i in range(3)]), rng.randint(0, 5000),
+                total / count if count else 0.0, count, self.past(),
+            )
+
+    def user_rows(self, password_hash: str) -> Iterator[tuple]:
+        for i, user_id in enumerate(self.user_ids):
+            role = Role.MERCHANT if i % 1000 == 0 else Role.CUSTOMER
+            yield (user_id, 'Seeded', f'User{i}', role.name, f'user{i}@iceedge.io', password_hash, f'{i} Balogun Gambari', self.past())
+
+    def order_rows(self) -> tuple[list[tuple], list[tuple], dict[tuple[str, int], datetime]]:
+        rng = self.rng
+        orders, items = [], []
+        # (customer, product) -> first purchase, reviews are generated from these
+        purchases: dict[tuple[str, int], datetime] = {}
+        statuses = [OrderStatus.DELIVERED.name] * 8 + [OrderStatus.PENDING.name, OrderStatus.CANCELLED.name]
+        for customer_id in self.active_users(self.orders):
+            order_id = new_uuid(rng)
+            placed = self.moment()
+            created_at = timestamp(placed)
+            lines = set(self.popular_products(rng.randint(1, self.max_items)))
+            total = quantity = 0
+            for product_id in lines:
+                line_quantity = rng.randint(1, 3)
+                items.append((len(items) + 1, self.prices[product_id], line_quantity, product_id, created_at, order_id))
+                total += self.prices[product_id] * line_quantity
+                quantity += line_quantity
+                purchases[customer_id, product_id] = min(placed, purchases.get((customer_id, product_id), placed))
+            orders.append((order_id, int(total + 1500), quantity, 1500.0, rng.choice(statuses), f'{rng.randrange(500)} Balogun Gambari', created_at, customer_id))
+        return orders, items, purchases
+
+    def cart_rows(self) -> tuple[list[tuple], list[tuple]]:
+        rng = self.rng
+        carts, items = [], []
+        for cart_id, user_id in enumerate(rng.sample(self.user_ids, self.carts), 1):
+            created_at = self.past()
+            total = 0.0
+            for product_id in set(self.popular_products(rng.randint(1, 4))):
+                quantity = rng.randint(1, 3)
+                items.append((len(items) + 1, self.prices[product_id], quantity, product_id, created_at, cart_id))
+                total += self.prices[product_id] * quantity
+            carts.append((cart_id, total, user_id, created_at))
+        return carts, items
+
+
+def generate(path: str, args: argparse.Namespace) -> dict:
+    engine = create_engine(f'sqlite:///{path}')
+    pragmas = {**BULK_LOAD_PRAGMAS, **dict(pragma.split('=', 1) for pragma in args.pragma)}
+
+    @event.listens_for(engine, 'connect')
+    def apply_bulk_pragmas(dbapi_connection, connection_record):
+        for name, value in pragmas.items():
+            dbapi_connection.execute(f'PRAGMA {name}={value}')
+
+    gen = Generator(args.users, args.products, args.reviews, args.orders, args.carts, args.max_items, args.zipf, args.user_zipf, args.seed, args.now)
+    timings, counts = {}, {}
+    started = time.perf_counter()
+
+    def timed(name: str, table: Table, columns: list[str], rows: Iterable[tuple]) -> None:
+        start = time.perf_counter()
+        counts[name] = bulk_insert(conn, table, columns, rows, args.batch_size)
+        timings[name] = round(time.perf_counter() - start, 2)
+
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        # secondary indexes are far cheaper to build once than to maintain row by row
+        indexes = [index for table in Base.metadata.sorted_tables for index in sorted(table.indexes, key=lambda index: index.name)]
+        for index in indexes:
+            index.drop(conn)
+
+        timed('categories', Category.__table__, ['id', 'name'], gen.category_rows())
+        start = time.perf_counter()
+        orders, order_items, purchases = gen.order_rows()
+        reviews, ratings = gen.review_rows(purchases)
+        del purchases
+        timings['generate_orders_and_reviews'] = round(time.perf_counter() - start, 2)
+        timed('products', Product.__table__, ['id', 'price', 'discount', 'name', 'description', 'cat_id', 'thumbnail', 'gallery', 'amt_left', 'avg_rating', 'ratings_count', 'created_at'], gen.product_rows(ratings))
+        timed('users', User.__table__, ['id', 'firstname', 'lastname', 'role', 'email', 'password', 'address', 'created_at'], gen.user_rows(hash_password(PASSWORD)))
+        timed('reviews', Review.__table__, ['id', 'content', 'rating', 'num_marked_useful', 'created_at', 'product_id', 'user_id'], reviews)
+        del reviews
+        timed('orders', Order.__table__, ['id', 'total', 'quantity', 'shipping_fee', 'status', 'shipping_address', 'created_at', 'customer_id'], orders)
+        timed('order_items', OrderItem.__table__, ['id', 'unit_price', 'quantity', 'product_id', 'created_at', 'order_id'], order_items)
+        carts, cart_items = gen.cart_rows()
+        timed('carts', Cart.__table__, ['id', 'total', 'user_id', 'created_at'], carts)
+        timed('cart_items', CartItem.__table__, ['id', 'unit_price', 'quantity', 'product_id', 'created_at', 'cart_id'], cart_items)
+
+        start = time.perf_counter()
+        for index in indexes:
+            index.create(conn)
+        for ddl in PRODUCT_SEARCH_DDL:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql(PRODUCT_SEARCH_REBUILD)
+        timings['indexes'] = round(time.perf_counter() - start, 2)
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql('ANALYZE')
+        # leave the file in the journal mode the app runs with
+        conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+    engine.dispose()
+    return {'path': path, 'seed': args.seed, 'now': args.now.isoformat(), 'rows': counts, 'seconds': timings, 'total_seconds': round(time.perf_counter() - started, 2), 'password': PASSWORD}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill a fresh SQLite database with deterministic, Zipf-skewed benchmark data')
+    parser.add_argument('--db', default='iceedge_bench.db')
+    parser.add_argument('--replace', action='store_true', help='overwrite the database file if it exists')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--products', type=int, default=50_000)
+    parser.add_argument('--reviews', type=int, default=250_000, help='at most the number of distinct customer and product purchases')
+    parser.add_argument('--orders', type=int, default=200_000)
+    parser.add_argument('--carts', type=int, default=20_000)
+    parser.add_argument('--max-items', type=int, default=5, help='most distinct products in one order')
+    parser.add_argument('--zipf', type=float, default=1.1, help='popularity skew of products')
+    parser.add_argument('--user-zipf', type=float, default=0.6, help='activity skew of customers')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--pragma', action='append', default=[], metavar='NAME=VALUE', help='override a bulk-load pragma')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--now', type=datetime.fromisoformat, default=datetime.fromisoformat(DEFAULT_NOW), help='instant the generated history ends at, ISO 8601')
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        if not args.replace:
+            parser.error(f'{args.db} already exists, pass --replace to overwrite it')
+        os.remove(args.db)
+    print(json.dumps(generate(args.db, args), indent=2))
@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import math
+import os
+import random
+import secrets
+import subprocess
+import tempfile
+import time
+from collections import Counter
+import httpx
+from .common import latency_summary, keep_cookies, zipf_cum_weights
+from .dataset import Dataset, seed_dataset
+
+BASE_URL = 'http://localhost'
+ZIPF_EXPONENT = 1.1
+MAX_ERROR_RATE = 0.01
+
+
+class Context:
+    def __init__(self, dataset: Dataset, seed: int):
+        self.dataset = dataset
+        # a few products get most of the traffic, like a real catalogue
+        ranked = list(dataset.product_ids)
+        random.Random(seed).shuffle(ranked)
+        self.ranked_products = ranked
+        self.popularity = zipf_cum_weights(len(ranked), ZIPF_EXPONENT)
+
+    def popular_product(self, rng: random.Random) -> int:
+        return rng.choices(self.ranked_products, cum_weights=self.popularity)[0]
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> httpx.Response:
+    res = await client.post('/user/login', data={'email': email, 'password': password})
+    keep_cookies(client, res)
+    return res
+
+
+async def browse(client: httpx.AsyncClient, state: dict, rng: random.Random, ctx: Context) -> httpx.Response:
+    params = {'limit': 20}
+    if state.get('cursor') and rng.random() < 0.7:
+        params['cursor'] = state['cursor']
+    res = await client.get('/products/', params=params)
+    state['cursor'] = res.json().get('next_cursor') if res.status_code == 200 else None
+    return res
+
+
+async def detail(client: httpx.AsyncClient, state: dict, rng: random.Random, ctx: Context) -> httpx.Response:
+    return await client.get(f'/products/{ctx.popular_product(rng)}')
+
+
+async def login_scenario(client: httpx.AsyncClient, state: dict, rng: random.Random, ctx: Context) -> httpx.Response:
+    return await client.post('/user/login', data={'email': state['email'], 'password': ctx.dataset.password})
+
+
+async def add_review(client: httpx.AsyncClient, state: dict, rng: random.Random, ctx: Context) -> httpx.Response:
+    to_review = state['to_review']
+    product_id = to_review.pop() if to_review else ctx.popular_product(rng)
+    res = await client.post('/review/', json={'content': 'Fits well and the fabric holds up', 'rating': rng.randint(1, 5), 'product_id': product_id})
+    keep_cookies(client, res)
+    return res
+
+
+async def place_order(client: httpx.AsyncClient, state: dict, rng: random.Random, ctx: Context) -> httpx.Response:
+    item = {'product_id': ctx.popular_product(rng), 'quantity': 2, 'unit_price': 5000.0, 'total': 10000.0}
+    res = await client.post('/order/', json={'total': 11500.0, 'shipping_fee': 1500.0, 'shipping_address': 'G50, Balogun Gambari', 'order_items': [item]})
+    keep_cookies(client, res)
+    return res
+
+
+# scenario name -> (request, needs a signed-in user)
+SCENARIOS = {
+    'browse': (browse, False),
+    'detail': (detail, False),
+    'login': (login_scenario, False),
+    'add_review': (add_review, True),
+    'place_order': (place_order, True),
+}
+
+
+async def run_scenario(transport: httpx.ASGITransport, name: str, ctx: Context, concurrency: int, requests: int, seed: int) -> dict:
+    request, needs_login = SCENARIOS[name]
+    issued = itertools.count()
+    latencies: list[float] = []
+    statuses: Counter[int] = Counter()
+
+    async def virtual_user(i: int):
+        rng = random.Random(seed + i)
+        email = ctx.dataset.emails[i]
+        async with httpx.AsyncClient(transport=transport, base_url=BASE_URL) as client:
+            if needs_login:
+                await login(client, email, ctx.dataset.password)
+            # shared across warmup and measured runs, so a product is never reviewed twice
+            state = {'email': email, 'to_review': ctx.dataset.purchases[email], 'cursor': None}
+            while next(issued) < requests:
+                start = time.perf_counter()
+                res = await request(client, state, rng, ctx)
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[res.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    errors = sum(count for code, count in statuses.items() if code >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': round(errors / max(len(latencies), 1), 4),
+        'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        **latency_summary(latencies),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        res = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(__file__), check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return res.stdout.strip()
+
+
+def import_db_engine(url: str, profile: str):
+    # the app builds its engines from ICEEDGE_DB_URL when db.engine is first imported,
+    # so the environment has to be set before anything pulls that module in
+    os.environ['ICEEDGE_DB_URL'] = url
+    os.environ['ICEEDGE_STORAGE_PROFILE'] = profile
+    os.environ.setdefault('ICEEDGE_CART_COOKIE_SECRET', secrets.token_urlsafe(32))
+    db_engine = importlib.import_module('..db.engine', __package__)
+    if db_engine.DB_URL != url:
+        raise RuntimeError(f'db.engine was imported before the load test set ICEEDGE_DB_URL, the app would use {db_engine.DB_URL}')
+    return db_engine
+
+
+async def run(args: argparse.Namespace, db_path: str) -> dict:
+    url = f'sqlite+aiosqlite:///{os.path.abspath(db_path)}'
+    users = max(args.users, args.concurrency)
+    # twice the fair share, a fast virtual user issues more than its share of the reviews
+    purchases_per_user = 2 * math.ceil((args.requests + args.warmup) / args.concurrency) + 1
+    db_engine = import_db_engine(url, args.profile)
+    engine = db_engine.make_engine(url, profile=args.profile, pool_size=1, max_overflow=0)
+    dataset = await seed_dataset(engine, users, args.products, purchases_per_user, args.seed)
+    await engine.dispose()
+
+    app = importlib.import_module('..main', __package__).app
+    ctx = Context(dataset, args.seed)
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with app.router.lifespan_context(app):
+        for name in args.scenarios:
+            if args.warmup:
+                await run_scenario(transport, name, ctx, args.concurrency, args.warmup, args.seed)
+            results[name] = await run_scenario(transport, name, ctx, args.concurrency, args.requests, args.seed + 1000)
+    return {
+        'revision': git_revision(),
+        'config': {'concurrency': args.concurrency, 'requests': args.requests, 'warmup': args.warmup, 'users': users, 'products': args.products, 'profile': args.profile, 'seed': args.seed, 'max_error_rate': args.max_error_rate},
+        'scenarios': results,
+        # latencies of a scenario that mostly errors measure the error path, not the endpoint
+        'failed_scenarios': [name for name, result in results.items() if result['error_rate'] > args.max_error_rate],
+    }
+
+
+def main(args: argparse.Namespace) -> dict:
+    if args.db:
+        return asyncio.run(run(args, args.db))
+    with tempfile.TemporaryDirectory() as tmp:
+        return asyncio.run(run(args, os.path.join(tmp, 'load_test.db')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive the API in-process and report throughput and latency per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=100, help='unmeasured requests per scenario')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--products', type=int, default=10_000)
+    parser.add_argument('--profile', default='performance')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='database file to seed, a temporary file by default; must not exist yet')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--max-error-rate', type=float, default=MAX_ERROR_RATE, help='exit non-zero when a scenario has a higher share of 4xx/5xx responses')
+    args = parser.parse_args()
+    result = main(args)
+    report = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    if result['failed_scenarios']:
+        raise SystemExit(f"Error rate above {args.max_error_rate} in: {', '.join(result['failed_scenarios'])}")
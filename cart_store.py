@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import time
+from typing import NamedTuple
+from uuid import UUID
+from sqlalchemy import select, update, delete, insert, func
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from .db.db_conn import async_session_maker, read_session_maker
+from .db.model import Cart, CartItem
+
+CART_BACKEND = os.environ.get('ICEEDGE_CART_BACKEND', 'database')
+CART_FLUSH_INTERVAL = 5.0
+CART_IDLE_SECONDS = 30 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class CartLine(NamedTuple):
+    quantity: int
+    unit_price: float
+
+
+def cart_as_dict(cart_id: int | None, lines: dict[int, CartLine]) -> dict:
+    items = [{'product_id': product_id, 'quantity': line.quantity, 'unit_price': line.unit_price} for product_id, line in sorted(lines.items())]
+    return {'cart_id': cart_id, 'items': items, 'total': sum(line.quantity * line.unit_price for line in lines.values())}
+
+
+async def load_cart(user_id: UUID, session_maker: async_sessionmaker = read_session_maker) -> tuple[int | None, dict[int, CartLine]]:
+    async with session_maker() as session:
+        cart_id = await session.scalar(select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.created_at.desc()).limit(1))
+        if cart_id is None:
+            return None, {}
+        rows = (await session.execute(select(CartItem.product_id, CartItem.quantity, CartItem.unit_price).where(CartItem.cart_id == cart_id))).all()
+    return cart_id, {row.product_id: CartLine(row.quantity, row.unit_price) for row in rows}
+
+
+class DatabaseCartStore:
+    async def get(self, user_id: UUID) -> dict:
+        return cart_as_dict(*(await load_cart(user_id)))
+
+    async def set_item(self, user_id: UUID, product_id: int, quantity: int, unit_price: float) -> None:
+        await self.set_items(user_id, {product_id: CartLine(quantity, unit_price)})
+
+    async def set_items(self, user_id: UUID, lines: dict[int, CartLine]) -> None:
+        async with async_session_maker() as session:
+            cart_id = await self._get_or_create_cart(session, user_id)
+            for product_id, line in lines.items():
+                q = update(CartItem).where(CartItem.cart_id == cart_id, CartItem.product_id == product_id).values(quantity=line.quantity, unit_price=line.unit_price)
+                if (await session.execute(q)).rowcount == 0:
+                    await session.execute(insert(CartItem).values(cart_id=cart_id, product_id=product_id, quantity=line.quantity, unit_price=line.unit_price))
+            await self._update_total(session, cart_id)
+            await session.commit()
+
+    async def remove_item(self, user_id: UUID, product_id: int) -> bool:
+        async with async_session_maker() as session:
+            cart_id = await session.scalar(select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.created_at.desc()).limit(1))
+            if cart_id is None:
+                return False
+            res = await session.execute(delete(CartItem).where(CartItem.cart_id == cart_id, CartItem.product_id == product_id))
+            await self._update_total(session, cart_id)
+            await session.commit()
+            return res.rowcount > 0
+
+    async def flush(self, user_id: UUID) -> int | None:
+        async with read_session_maker() as session:
+            return await session.scalar(select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.created_at.desc()).limit(1))
+
+    def discard(self, user_id: UUID) -> None:
+        pass
+
+    def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def _get_or_create_cart(self, session, user_id: UUID) -> int:
+        cart_id = await session.scalar(select(Cart.id).where(Cart.user_id == user_id).order_by(Cart.created_at.desc()).limit(1))
+        if cart_id is None:
+            cart = Cart(user_id=user_id, total=0)
+            session.add(cart)
+            await session.flush()
+            cart_id = cart.id
+        return cart_id
+
+    async def _update_total(self, session, cart_id: int) -> None:
+        total = select(func.coalesce(func.sum(CartItem.unit_price * CartItem.quantity), 0)).where(CartItem.cart_id == cart_id).scalar_subquery()
+        await session.execute(update(Cart).where(Cart.id == cart_id).values(total=total))
+
+
+class CartState:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.flush_lock = asyncio.Lock()
+        self.loaded = False
+        self.cart_id: int | None = None
+        self.lines: dict[int, CartLine] = {}
+        self.version = 0
+        self.flushed_version = 0
+        self.last_access = time.monotonic()
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.flushed_version
+
+
+class MemoryCartStore:
+    def __init__(self, flush_interval: float = CART_FLUSH_INTERVAL, idle_seconds: float = CART_IDLE_SECONDS, session_maker: async_sessionmaker = async_session_maker, read_session_maker: async_sessionmaker = read_session_maker):
+        self.flush_interval = flush_interval
+        self.idle_seconds = idle_seconds
+        self.session_maker = session_maker
+        self.read_session_maker = read_session_maker
+        self._carts: dict[UUID, CartState] = {}
+        self._task: asyncio.Task | None = None
+
+    async def _state(self, user_id: UUID) -> CartState:
+        state = self._carts.get(user_id)
+        if state is None:
+            state = self._carts[user_id] = CartState()
+        state.last_access = time.monotonic()
+        if not state.loaded:
+            async with state.lock:
+                if not state.loaded:
+                    state.cart_id, state.lines = await load_cart(user_id, self.read_session_maker)
+                    state.loaded = True
+        return state
+
+    async def get(self, user_id: UUID) -> dict:
+        state = await self._state(user_id)
+        return cart_as_dict(state.cart_id, state.lines)
+
+    async def set_item(self, user_id: UUID, product_id: int, quantity: int, unit_price: float) -> None:
+        await self.set_items(user_id, {product_id: CartLine(quantity, unit_price)})
+
+    async def set_items(self, user_id: UUID, lines: dict[int, CartLine]) -> None:
+        state = await self._state(user_id)
+        async with state.lock:
+            state.lines.update(lines)
+            state.version += 1
+
+    async def remove_item(self, user_id: UUID, product_id: int) -> bool:
+        state = await self._state(user_id)
+        async with state.lock:
+            if state.lines.pop(product_id, None) is None:
+                return False
+            state.version += 1
+            return True
+
+    async def flush(self, user_id: UUID) -> int | None:
+        state = self._carts.get(user_id)
+        if state is None:
+            return (await load_cart(user_id, self.read_session_maker))[0]
+        await self._flush_state(user_id, state)
+        return state.cart_id
+
+    async def flush_all(self) -> None:
+        for user_id, state in list(self._carts.items()):
+            if state.dirty:
+                try:
+                    await self._flush_state(user_id, state)
+                except Exception:
+                    logger.exception('Failed to flush cart of user %s', user_id)
+
+    def discard(self, user_id: UUID) -> None:
+        self._carts.pop(user_id, None)
+
+    def evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_seconds
+        for user_id, state in list(self._carts.items()):
+            if state.last_access < cutoff and not state.dirty and not state.lock.locked() and not state.flush_lock.locked():
+                del self._carts[user_id]
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_all()
+            self.evict_idle()
+
+    async def _flush_state(self, user_id: UUID, state: CartState) -> None:
+        async with state.flush_lock:
+            if not state.dirty:
+                return
+            async with state.lock:
+                version, lines = state.version, dict(state.lines)
+            total = sum(line.quantity * line.unit_price for line in lines.values())
+            cart_id = state.cart_id
+            async with self.session_maker() as session:
+                if cart_id is None:
+                    cart = Cart(user_id=user_id, total=total)
+                    session.add(cart)
+                    await session.flush()
+                    cart_id = cart.id
+                else:
+                    await session.execute(update(Cart).where(Cart.id == cart_id).values(total=total))
+                    await session.execute(delete(CartItem).where(CartItem.cart_id == cart_id))
+                if lines:
+                    rows = [{'cart_id': cart_id, 'product_id': product_id, 'quantity': line.quantity, 'unit_price': line.unit_price} for product_id, line in lines.items()]
+                    await session.execute(insert(CartItem), rows)
+                await session.commit()
+            state.cart_id = cart_id
+            state.flushed_version = max(state.flushed_version, version)
+
+
+cart_store = MemoryCartStore() if CART_BACKEND == 'memory' else DatabaseCartStore()
@@ -0,0 +1,29 @@
+from types import MappingProxyType
+from typing import Mapping
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from .db_conn import AsyncSession
+from .model import Category
+from .schema import Cat
+
+_category_ids: Mapping[Cat, int] = MappingProxyType({})
+
+
+async def load_category_map(session: AsyncSession) -> Mapping[Cat, int]: 
+    global _category_ids
+    rows = (await session.execute(select(Category.name, Category.id))).all()
+    ids = {Cat(getattr(name, 'value', name)): id for name, id in rows}
+    missing = [Category(name=cat) for cat in Cat if cat not in ids]
+    if missing: 
+        session.add_all(missing)
+        await session.commit()
+        ids.update({Cat(getattr(c.name, 'value', c.name)): c.id for c in missing})
+    _category_ids = MappingProxyType(ids)
+    return _category_ids
+
+
+def category_id(cat: Cat) -> int: 
+    try: 
+        return _category_ids[cat]
+    except KeyError: 
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'Unknown category {cat}')
@@ -1,10 +1,19 @@
 from collections.abc import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession , create_async_engine, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession , async_sessionmaker
 from  .model import Base
+from .engine import DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_READ_POOL_SIZE, make_engine, is_sqlite_file
+from .search import create_product_search
 
-DB_URL='sqlite+aiosqlite:///./iceedge.db'
-engine = create_async_engine(DB_URL) 
-async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
+if is_sqlite_file(DB_URL): 
+    # SQLite allows one writer at a time, so a single writer connection serializes mutations
+    # while a pool of read-only connections serves reads concurrently off the WAL
+    write_engine = make_engine(DB_URL, pool_size=1, max_overflow=0)
+    read_engine = make_engine(DB_URL, pool_size=DB_READ_POOL_SIZE, max_overflow=0, read_only=True)
+else: 
+    write_engine = read_engine = make_engine(DB_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+engine = write_engine
+async_session_maker = async_sessionmaker(write_engine, expire_on_commit=False)
+read_session_maker = async_sessionmaker(read_engine, expire_on_commit=False)
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]: 
@@ -12,6 +21,13 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]: 
+    async with read_session_maker() as session: 
+        yield session
+
+
 async def create_all_tables(): 
-    async with engine.begin() as conn: 
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+    async with write_engine.begin() as conn: 
+        await conn.run_sync(Base.metadata.create_all)
+        if conn.dialect.name == 'sqlite': 
+            await create_product_search(conn)
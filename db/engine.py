@@ -0,0 +1,60 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+DB_URL = os.environ.get('ICEEDGE_DB_URL', 'sqlite+aiosqlite:///./iceedge.db')
+STORAGE_PROFILE = os.environ.get('ICEEDGE_STORAGE_PROFILE', 'performance')
+DB_POOL_SIZE = int(os.environ.get('ICEEDGE_DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('ICEEDGE_DB_MAX_OVERFLOW', 5))
+DB_READ_POOL_SIZE = int(os.environ.get('ICEEDGE_DB_READ_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = 30
+
+STORAGE_PROFILES = {
+    'default': {},
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -65536,  # negative means KiB, i.e. 64 MiB per connection
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def apply_pragmas(engine: AsyncEngine, pragmas: dict) -> None: 
+    if engine.dialect.name != 'sqlite' or not pragmas: 
+        return
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record): 
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items(): 
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def is_sqlite_file(url: str) -> bool: 
+    return url.startswith('sqlite') and ':memory:' not in url
+
+
+def read_only_url(url: str) -> str: 
+    scheme, path = url.split(':///', 1)
+    return f'{scheme}:///file:{path}?mode=ro&uri=true'
+
+
+def make_engine(url: str = DB_URL, profile: str = STORAGE_PROFILE, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW, read_only: bool = False, **kwargs) -> AsyncEngine: 
+    if profile not in STORAGE_PROFILES: 
+        raise ValueError(f'Unknown storage profile {profile!r}, expected one of {sorted(STORAGE_PROFILES)}')
+    if ':memory:' not in url: 
+        kwargs.update(poolclass=AsyncAdaptedQueuePool, pool_size=pool_size, max_overflow=max_overflow, pool_timeout=DB_POOL_TIMEOUT)
+    pragmas = dict(STORAGE_PROFILES[profile])
+    if read_only and is_sqlite_file(url): 
+        url = read_only_url(url)
+        pragmas['query_only'] = 'ON'
+        # journal_mode is a property of the database file, only the writer may change it
+        pragmas.pop('journal_mode', None)
+    engine = create_async_engine(url, **kwargs)
+    apply_pragmas(engine, pragmas)
+    return engine
@@ -1,52 +1,45 @@
+import hashlib
 import secrets
 from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
-from sqlalchemy import DateTime, String, Text, Integer, Float, JSON, Enum, ForeignKey
+from sqlalchemy import DateTime, String, Text, Integer, Float, JSON, Enum, ForeignKey, Index, Boolean
 from datetime import datetime
 from typing import List, Optional
 from datetime import timezone, timedelta
 from uuid import uuid4, UUID
+from .schema import Role, Cat, OrderStatus
 
 def get_expiration_date(duration_seconds: int = 86400) -> datetime:
     return datetime.now(tz=timezone.utc) + timedelta(seconds=duration_seconds)
 
 def generate_token() -> str: 
     return secrets.token_urlsafe(32) 
+
+def hash_token(token: str) -> str: 
+    # tokens are random, so a plain fast hash is enough and a leaked table holds no usable tokens
+    return hashlib.sha256(token.encode()).hexdigest()
 class Base(DeclarativeBase):
     pass 
 
-class Role(Enum): 
-    ADMIN = 'admin'
-    CUSTOMER = 'customer' 
-    DEVELOPER = 'developer'
-
-class Cat(Enum): 
-    SHIIRT = "shirt"
-    PANT = 'pant'
-    CAP = 'cap'
-    SHOE = 'shoe'
-    SOCK = 'sock'
-
-class OrderStatus(Enum): 
-    DELIVERED='delivered'
-    CANCELLED='cancelled'
-    PENDING='pending'
-
 class Product(Base): 
     __tablename__='products'
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     price: Mapped[float] = mapped_column(Float) 
-    discount: Mapped[float] = mapped_column(Floatdefault=0) 
+    discount: Mapped[float] = mapped_column(Float, default=0) 
     name: Mapped[str] = mapped_column(String(255), unique=True)  
     description: Mapped[str] = mapped_column(Text) 
-    cat_id: Mapped[int] = mapped_column(ForeignKey('category.id'), index=True) 
+    cat_id: Mapped[int] = mapped_column(ForeignKey('categories.id'), index=True) 
     thumbnail: Mapped[str] = mapped_column(String(255))
     gallery: Mapped[list[str]] = mapped_column(JSON) 
     amt_left: Mapped[int] = mapped_column(Integer)  
     avg_rating: Mapped[float] = mapped_column(Float, default=0) 
-    ratings_count: Mapped[int] = mapped_column(Float, default=0) 
+    ratings_count: Mapped[int] = mapped_column(Integer, default=0) 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now) 
-    reviews: Mapped[Optional[List["Review"]]] = relationship("Review", cascade='all, delete') 
+    reviews: Mapped[Optional[List["Review"]]] = relationship("Review", back_populates='product', cascade='all, delete') 
     cat: Mapped['Category'] = relationship(back_populates='products')
+    __table_args__ = (
+        Index('ix_products_created_at_id', 'created_at', 'id'),
+        Index('ix_products_cat_id_created_at_id', 'cat_id', 'created_at', 'id'),
+    )
 
 class User(Base): 
     __tablename__='users'
@@ -58,21 +51,34 @@ class User(Base):
     password: Mapped[str] = mapped_column(String(255)) 
     address: Mapped[ Optional[str]] = mapped_column(Text) 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now) 
-    orders: Mapped[Optional[List["Order"]]] = relationship("Order", cascade='all, delete')
-    reviews: Mapped[Optional['Review']]  = relationship(back_populates='user')
+    orders: Mapped[Optional[List["Order"]]] = relationship("Order", back_populates='customer', cascade='all, delete')
+    reviews: Mapped[Optional[List['Review']]]  = relationship(back_populates='user')
 
 
 class Review(Base): 
     __tablename__ = 'reviews'
     id: Mapped[int] = mapped_column(Integer, primary_key=True) 
     content: Mapped[str] = mapped_column(Text)     
-    rating: Mapped[float] = mapped_column(Float, max=5.0, min=1.0) 
+    rating: Mapped[float] = mapped_column(Float) 
     num_marked_useful: Mapped[int] = mapped_column(Integer, default=0) 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now) 
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'), index=True)  
+    product_id: Mapped[int] = mapped_column(ForeignKey('products.id'))  
     user_id: Mapped[UUID] = mapped_column(ForeignKey('users.id'), index=True)
     user: Mapped['User'] = relationship(back_populates='reviews')
     product: Mapped["Product"] = relationship( back_populates='reviews') 
+    # one per review sort mode, each also serves plain product_id lookups
+    __table_args__ = (
+        Index('ix_reviews_product_id_created_at_id', 'product_id', 'created_at', 'id'),
+        Index('ix_reviews_product_id_useful_id', 'product_id', 'num_marked_useful', 'id'),
+        Index('ix_reviews_product_id_rating_id', 'product_id', 'rating', 'id'),
+    )
+
+
+class ReviewVote(Base): 
+    __tablename__ = 'review_votes'
+    review_id: Mapped[int] = mapped_column(ForeignKey('reviews.id'), primary_key=True)
+    user_id: Mapped[UUID] = mapped_column(ForeignKey('users.id'), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now) 
 
 
 class Order(Base): 
@@ -81,12 +87,15 @@ class Order(Base):
     total: Mapped[float] = mapped_column(Integer) 
     quantity: Mapped[int] = mapped_column(Integer, default=1) 
     shipping_fee: Mapped[float] = mapped_column(Float) 
-    status: Mapped[OrderStatus] = mapped_column(OrderStatus) 
+    status: Mapped[OrderStatus] = mapped_column(Enum(OrderStatus)) 
     shipping_address: Mapped[Optional[str]] = mapped_column(String(255)) 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now) 
-    customer_id: Mapped[int] = mapped_column(ForeignKey('user.id')) 
+    customer_id: Mapped[UUID] = mapped_column(ForeignKey('users.id')) 
     customer: Mapped["User"] = relationship("User", back_populates="orders") 
-    order_items: Mapped[List['OrderItem']] = relationship("Item") 
+    order_items: Mapped[List['OrderItem']] = relationship() 
+    __table_args__ = (
+        Index('ix_orders_created_at_id', 'created_at', 'id'),
+    )
 
 
 class Category(Base): 
@@ -112,7 +121,7 @@ class OrderItem(Base):
     product_id: Mapped[int] = mapped_column(ForeignKey('products.id')) 
     product: Mapped['Product'] = relationship("Product", lazy='joined') 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now) 
-    order_id: Mapped[int] = mapped_column(ForeignKey('orders.id'), index=True)
+    order_id: Mapped[UUID] = mapped_column(ForeignKey('orders.id'), index=True)
 
 class CartItem(Base):
     __tablename__="cart_items"
@@ -129,16 +138,30 @@ class Cart(Base):
     __tablename__= "carts"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True) 
     total: Mapped[float] = mapped_column(Float, nullable=False) 
-    user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), index=True)
+    user_id: Mapped[UUID] = mapped_column(ForeignKey('users.id'), index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now) 
     cart_items: Mapped[List["CartItem"]] = relationship(back_populates='cart')
 
+class Job(Base): 
+    __tablename__= 'jobs'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(64))
+    payload: Mapped[dict] = mapped_column(JSON)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[bool] = mapped_column(Boolean, default=False)
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    __table_args__ = (
+        Index('ix_jobs_failed_run_after', 'failed', 'run_after'),
+    )
+
 class AccessToken(Base): 
     __tablename__= 'token'
     id: Mapped[int] = mapped_column( Integer,primary_key=True, autoincrement=True)
-    expiration_date: Mapped[datetime] = mapped_column(DateTime, default=get_expiration_date)
-    token: Mapped[str] = mapped_column(String(1024), default=generate_token) 
-    user_id: Mapped[int] = mapped_column(ForeignKey('users.id')) 
+    expiration_date: Mapped[datetime] = mapped_column(DateTime, default=get_expiration_date, index=True)
+    token_hash: Mapped[str] = mapped_column(String(64), unique=True) 
+    user_id: Mapped[UUID] = mapped_column(ForeignKey('users.id')) 
     user: Mapped["User"] = relationship(lazy='joined')
     def max_age(self) -> int:
         delta = self.expiration_date - datetime.now(tz=timezone.utc)
@@ -0,0 +1,160 @@
+import csv
+import json
+from typing import AsyncIterator
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from .db_conn import AsyncSession
+from .model import Product
+from .schema import ProductCreate
+from .categories import category_id
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_BATCH_SIZE = 5000
+IMPORT_MAX_REPORTED_ERRORS = 1000
+IMPORT_MAX_ROW_BYTES = 1024 * 1024
+
+
+def row_too_large() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f'A single row may not exceed {IMPORT_MAX_ROW_BYTES} bytes')
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+        # a body without newlines would otherwise be buffered whole
+        if len(buffer) > IMPORT_MAX_ROW_BYTES:
+            raise row_too_large()
+    if buffer:
+        yield buffer
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | str]]:
+    row = 0
+    async for line in lines:
+        row += 1
+        if not line.strip():
+            continue
+        try:
+            yield row, json.loads(line)
+        except ValueError as e:
+            yield row, f'Invalid JSON: {e}'
+
+
+async def iter_csv_records(lines: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, str]]:
+    # a quoted field may span lines, so lines are joined until every quote is closed
+    record = ''
+    line_no = start = size = 0
+    async for line in lines:
+        line_no += 1
+        if not record:
+            start, size = line_no, 0
+        size += len(line)
+        if size > IMPORT_MAX_ROW_BYTES:
+            raise row_too_large()
+        record += line.decode('utf-8-sig').rstrip('\r') + '\n'
+        if record.count('"') % 2 == 0:
+            yield start, record
+            record = ''
+    if record:
+        yield start, record
+
+
+async def iter_csv_rows(lines: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | str]]:
+    header = None
+    async for row, text in iter_csv_records(lines):
+        if not text.strip():
+            continue
+        if text.count('"') % 2:
+            yield row, 'Quoted field is not closed'
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield row, f'Expected {len(header)} columns, got {len(values)}'
+            continue
+        data = dict(zip(header, values))
+        if 'gallery' in data:
+            data['gallery'] = [img for img in data['gallery'].split('|') if img]
+        yield row, data
+
+
+def validation_errors(e: ValidationError) -> list[str]:
+    return [f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()]
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def fail(self, row: int, errors: list[str]):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self) -> dict:
+        return {'inserted': self.inserted, 'failed': self.failed, 'errors': self.errors, 'errors_truncated': self.failed > len(self.errors)}
+
+
+async def insert_batch(session: AsyncSession, batch: list[tuple[int, dict]], report: ImportReport):
+    stmt = sqlite_insert(Product).on_conflict_do_nothing(index_elements=[Product.name]).returning(Product.name)
+    try:
+        inserted = set((await session.execute(stmt, [values for _, values in batch])).scalars())
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        inserted = set()
+        for row, values in batch:
+            try:
+                await session.execute(sqlite_insert(Product), [values])
+                await session.commit()
+                inserted.add(values['name'])
+            except IntegrityError as e:
+                await session.rollback()
+                report.fail(row, [str(e.orig)])
+        report.inserted += len(inserted)
+        return
+    report.inserted += len(inserted)
+    for row, values in batch:
+        if values['name'] not in inserted:
+            report.fail(row, ['name: A product with this name already exists'])
+
+
+async def import_products(session: AsyncSession, rows: AsyncIterator[tuple[int, dict | str]], batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    report = ImportReport()
+    batch: list[tuple[int, dict]] = []
+    names_in_batch: set[str] = set()
+    async for row, data in rows:
+        if isinstance(data, str):
+            report.fail(row, [data])
+            continue
+        try:
+            product = ProductCreate.model_validate(data)
+        except ValidationError as e:
+            report.fail(row, validation_errors(e))
+            continue
+        if product.name in names_in_batch:
+            report.fail(row, ['name: Duplicate name in upload'])
+            continue
+        try:
+            cat_id = category_id(product.cat)
+        except HTTPException as e:
+            report.fail(row, [f'cat: {e.detail}'])
+            continue
+        names_in_batch.add(product.name)
+        batch.append((row, {**product.model_dump(exclude={'cat'}), 'cat_id': cat_id}))
+        if len(batch) >= batch_size:
+            await insert_batch(session, batch, report)
+            batch, names_in_batch = [], set()
+    if batch:
+        await insert_batch(session, batch, report)
+    return report.as_dict()
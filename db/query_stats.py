@@ -0,0 +1,106 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_REPEAT_THRESHOLD = 10
+QUERY_SLOWEST_COUNT = 3
+SERVER_TIMING_SQL_LENGTH = 80
+# statement text in Server-Timing is visible to any client, keep it to local debugging
+QUERY_STATS_DEBUG = os.environ.get('ICEEDGE_QUERY_STATS_DEBUG', '') == '1'
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    # expanded IN (...) lists differ only in their number of placeholders
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+def timing_desc(shape: str) -> str:
+    return shape[:SERVER_TIMING_SQL_LENGTH].replace('\\', '').replace('"', "'")
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest: list[tuple[float, str]] = []
+        self.shapes: Counter[str] = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        shape = statement_shape(statement)
+        self.count += 1
+        self.total += seconds
+        self.shapes[shape] += 1
+        if len(self.slowest) < QUERY_SLOWEST_COUNT or seconds > self.slowest[-1][0]:
+            self.slowest.append((seconds, shape))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[QUERY_SLOWEST_COUNT:]
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> list[tuple[str, int]]:
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def server_timing(self, threshold: int = QUERY_REPEAT_THRESHOLD, debug: bool = False) -> str:
+        metrics = [f'db;dur={self.total * 1000:.2f};desc="{self.count} queries"']
+        for i, (seconds, shape) in enumerate(self.slowest, 1):
+            desc = f';desc="{timing_desc(shape)}"' if debug else ''
+            metrics.append(f'db-slow-{i};dur={seconds * 1000:.2f}{desc}')
+        for i, (shape, count) in enumerate(self.repeated(threshold), 1):
+            desc = f'{count}x {timing_desc(shape)}' if debug else f'{count}x'
+            metrics.append(f'db-repeated-{i};desc="{desc}"')
+        return ', '.join(metrics)
+
+
+current_query_stats: ContextVar[QueryStats | None] = ContextVar('current_query_stats', default=None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if current_query_stats.get() is not None:
+        conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    stats = current_query_stats.get()
+    started = conn.info.get('query_started_at')
+    if stats is None or not started:
+        return
+    stats.record(statement, time.perf_counter() - started.pop())
+
+
+class QueryStatsMiddleware:
+    def __init__(self, app, repeat_threshold: int = QUERY_REPEAT_THRESHOLD, debug: bool = QUERY_STATS_DEBUG):
+        self.app = app
+        self.repeat_threshold = repeat_threshold
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start' and stats.count:
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', stats.server_timing(self.repeat_threshold, self.debug).encode('latin-1', 'replace')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_query_stats.reset(token)
+            route = getattr(scope.get('route'), 'path_format', None) or scope['path']
+            for shape, count in stats.repeated(self.repeat_threshold):
+                logger.warning('Likely N+1 on %s %s: statement ran %s times: %s', scope['method'], route, count, shape)
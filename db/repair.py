@@ -0,0 +1,29 @@
+import argparse
+import asyncio
+from sqlalchemy import select, update, func
+from .db_conn import AsyncSession, async_session_maker
+from .model import Product, Review
+
+
+async def recompute_product_ratings(session: AsyncSession, batch_size: int = 1000) -> int: 
+    ratings_count = select(func.count(Review.id)).where(Review.product_id == Product.id).scalar_subquery()
+    avg_rating = select(func.coalesce(func.avg(Review.rating), 0)).where(Review.product_id == Product.id).scalar_subquery()
+    max_id = (await session.scalar(select(func.max(Product.id)))) or 0
+    repaired = 0
+    for start in range(0, max_id + 1, batch_size): 
+        q = update(Product).where(Product.id.between(start, start + batch_size - 1)).values(ratings_count=ratings_count, avg_rating=avg_rating)
+        repaired += (await session.execute(q)).rowcount
+        await session.commit()
+    return repaired
+
+
+async def main(batch_size: int): 
+    async with async_session_maker() as session: 
+        repaired = await recompute_product_ratings(session, batch_size)
+    print(f'Recomputed ratings for {repaired} products')
+
+
+if __name__ == '__main__': 
+    parser = argparse.ArgumentParser(description='Recompute Product.avg_rating and ratings_count from the reviews table')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    asyncio.run(main(parser.parse_args().batch_size))
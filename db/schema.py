@@ -20,7 +20,7 @@ class Cat(str, Enum):
     SOCK = 'sock'
     MASK = "mask"
 
-class Message: 
+class Message(BaseModel): 
     detail: str = "Something went wrong!"
 
 class OrderStatus(str, Enum): 
@@ -46,10 +46,28 @@ class ProductCreate(ProductBase):
 
 class ProductRead(ProductBase): 
     id: int  
-    avg_rating: float = Field(0, ge=1.0, le=5.0)
+    avg_rating: float = Field(0, ge=0, le=5.0)
     ratings_count: int = Field(0, ge=0)
     reviews: list["ReviewRead"] | None = Field(None) 
 
+class ProductPage(BaseModel): 
+    items: list[ProductRead] 
+    next_cursor: str | None = None 
+
+class ProductSummary(BaseModel): 
+    id: int 
+    name: str 
+    price: float 
+    discount: int 
+    thumbnail: str 
+    cat: Cat 
+    avg_rating: float = Field(0, ge=0, le=5.0)
+    ratings_count: int = Field(0, ge=0)
+
+class ProductSummaryPage(BaseModel): 
+    items: list[ProductSummary] 
+    next_cursor: str | None = None 
+
 class ProductUpdate(BaseModel): 
     discount:  int | None = Field(None, ge=0, le=99) 
     name:  str | None = Field(None) 
@@ -59,8 +77,6 @@ class ProductUpdate(BaseModel):
     thumbnail:  str | None = Field(None) 
     gallery: list[str | None] = Field(None) 
     amt_left:  int | None = Field(None, ge=1) 
-    avg_rating:  float | None = Field(None, ge=1.0, le=5.0)
-    ratings_count:  int | None = Field(None, ge=0)
 
 class UserBase(BaseModel): 
     firstname: str 
@@ -80,10 +96,16 @@ class UserCreate(UserBase):
             raise ValueError("Passwords must match!") 
         return self
 
-class UserRead(UserBase): 
-    id: int 
+class UserRead(BaseModel): 
+    id: UUID 
+    firstname: str 
+    lastname: str 
+    email: EmailStr 
+    address: str | None = None 
     role: Role = Field(default=Role.CUSTOMER)  
-    orders: list["OrderRead"] | None = Field(None) 
+    created_at: datetime 
+    class Config: 
+        from_attributes=True 
     
     
 class UserUpdate(BaseModel): 
@@ -112,6 +134,13 @@ class ReviewRead(ReviewBase):
     user: UserRead
     
     
+class ReviewSummary(BaseModel): 
+    id: int 
+    content: str 
+    rating: float 
+    num_marked_useful: int = Field(0)
+    created_at: datetime 
+
 class ReviewUpdate(BaseModel): 
     content: str | None = Field(None)
     rating: float | None = Field(None, ge=1.0, le=5.0)
@@ -121,14 +150,13 @@ class OrderBase(BaseModel):
     shipping_fee: float 
     shipping_address: str 
     created_at: datetime = Field(default_factory=datetime.now) 
-    customer_id: UUID | None = None 
     order_status: OrderStatus = Field(OrderStatus.PENDING)  
     order_items: list["ItemRead"]
     class Config:
         orm_mode=True 
 
 class OrderCreate(OrderBase): 
-    pass 
+    order_items: list["ItemCreate"] = Field(..., min_length=1)
 
 class OrderRead(OrderBase): 
     id: int 
@@ -180,6 +208,17 @@ class CartItem(ItemRead):
 class OrderItem(ItemRead):
     order_id: int
 
+class CartItemSet(BaseModel): 
+    quantity: int = Field(..., ge=1) 
+
+class Checkout(BaseModel): 
+    shipping_address: str | None = Field(None) 
+
+class CheckoutRead(BaseModel): 
+    order_id: UUID 
+    total: float 
+    order_item_ids: list[int] 
+
 class CartUpdate(BaseModel): 
     total: float | None = Field( None, ge=4999.99) 
     quantity: int | None = Field (None,  gt=1) 
@@ -191,3 +230,7 @@ class Credential(BaseModel):
     password: str 
     class Config: 
         orm_mode=True 
+
+class Token(BaseModel): 
+    access_token: str 
+    token_type: str = 'bearer' 
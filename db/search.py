@@ -0,0 +1,35 @@
+import re
+from sqlalchemy import text, column, Integer, Float
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+PRODUCT_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(name, description, content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+PRODUCT_SEARCH_REBUILD = "INSERT INTO products_fts(products_fts) VALUES ('rebuild')"
+
+# name matches weigh ten times as much as description matches
+ranked_products = text(
+    "SELECT rowid AS id, bm25(products_fts, 10.0, 1.0) AS score FROM products_fts WHERE products_fts MATCH :match"
+).columns(column('id', Integer), column('score', Float)).subquery('ranked_products')
+
+
+def match_expression(query: str) -> str | None:
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+async def create_product_search(conn: AsyncConnection) -> None:
+    exists = (await conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'"))).first()
+    for ddl in PRODUCT_SEARCH_DDL:
+        await conn.execute(text(ddl))
+    if not exists:
+        await conn.execute(text(PRODUCT_SEARCH_REBUILD))
@@ -1,23 +1,31 @@
-from .db.model import AccessToken
+from .db.model import AccessToken, hash_token
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy import select, and_ 
 from .db.schema import Role
 from .db.model import User 
 from fastapi.security import APIKeyCookie
 from fastapi import Depends, status, HTTPException
-from .db.db_conn import AsyncSession, get_async_session
+from .db.db_conn import AsyncSession, get_read_session
 from datetime import timezone, datetime
-from .main import TOKEN_COOKIE_NAME
+from .security.token_cache import token_cache, CachedUser
 
-async def get_current_user_by_token(token_str: str = Depends(OAuth2PasswordBearer(tokenUrl='/token')), session: AsyncSession = Depends(get_async_session)):
-    q = select(AccessToken).where(and_(AccessToken.token == token_str, AccessToken.expiration_date == datetime.now(tz=timezone.utc)))
+TOKEN_COOKIE_NAME='token'
+
+async def get_current_user_by_token(token_str: str = Depends(OAuth2PasswordBearer(tokenUrl='/user/token')), session: AsyncSession = Depends(get_read_session)):
+    token_hash = hash_token(token_str)
+    user = token_cache.get(token_hash)
+    if user: 
+        return user 
+    q = select(AccessToken).where(and_(AccessToken.token_hash == token_hash, AccessToken.expiration_date > datetime.now(tz=timezone.utc)))
     token = (await session.scalars(q)).one_or_none() 
     if not token: 
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED) 
-    return token.user 
+    user = CachedUser.from_user(token.user)
+    token_cache.put(token_hash, user, token.expiration_date)
+    return user 
 
-async def get_curr_user(token: str = Depends(APIKeyCookie(name=TOKEN_COOKIE_NAME))): 
-    user = await get_current_user_by_token(token_str=token) 
+async def get_curr_user(token: str = Depends(APIKeyCookie(name=TOKEN_COOKIE_NAME)), session: AsyncSession = Depends(get_read_session)): 
+    user = await get_current_user_by_token(token_str=token, session=session) 
     return user
 
  
@@ -38,6 +46,6 @@ class Rbac:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
         return None
     
-    async def accessible_to(self): 
-        return (await self.role_is_in())
+    async def accessible_to(self, user: User = Depends(get_curr_user)): 
+        return (await self.role_is_in(user))
     
\ No newline at end of file
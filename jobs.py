@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from sqlalchemy import event, select, update, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from .db.db_conn import AsyncSession, async_session_maker, read_session_maker
+from .db.model import Job
+
+JOB_WORKERS = 4
+JOB_MAX_ATTEMPTS = 5
+JOB_BACKOFF_SECONDS = 0.5
+JOB_POLL_INTERVAL = 30.0
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict[str, Callable[[dict], Awaitable[None]]] = {}
+
+
+def job(name: str):
+    def register(handler: Callable[[dict], Awaitable[None]]):
+        _handlers[name] = handler
+        return handler
+    return register
+
+
+def enqueue(session: AsyncSession, name: str, payload: dict) -> Job:
+    if name not in _handlers:
+        raise ValueError(f'No job handler registered for {name!r}')
+    pending = Job(name=name, payload=payload)
+    session.add(pending)
+    session.info.setdefault('enqueued_jobs', []).append(pending)
+    return pending
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, session_maker: async_sessionmaker = async_session_maker, read_session_maker: async_sessionmaker = read_session_maker):
+        self.workers = workers
+        self.session_maker = session_maker
+        self.read_session_maker = read_session_maker
+        self._queue: asyncio.Queue[int] = asyncio.Queue()
+        self._queued: set[int] = set()
+        self._tasks: list[asyncio.Task] = []
+
+    def notify(self, job_ids: list[int]) -> None:
+        for job_id in job_ids:
+            if job_id not in self._queued:
+                self._queued.add(job_id)
+                self._queue.put_nowait(job_id)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                async with self.read_session_maker() as session:
+                    q = select(Job.id).where(Job.failed == False, Job.run_after <= datetime.now()).order_by(Job.run_after)
+                    self.notify(list((await session.scalars(q)).all()))
+            except Exception:
+                logger.exception('Failed to poll the job outbox')
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception('Failed to run job %s', job_id)
+            finally:
+                self._queued.discard(job_id)
+
+    async def _run(self, job_id: int) -> None:
+        async with self.read_session_maker() as session:
+            pending = await session.get(Job, job_id)
+        if pending is None or pending.failed or pending.run_after > datetime.now():
+            return
+        try:
+            handler = _handlers[pending.name]
+            await handler(pending.payload)
+        except Exception as e:
+            attempts = pending.attempts + 1
+            delay = JOB_BACKOFF_SECONDS * 2 ** (attempts - 1)
+            failed = attempts >= JOB_MAX_ATTEMPTS
+            logger.warning('Job %s (%s) failed on attempt %s: %r', job_id, pending.name, attempts, e)
+            async with self.session_maker() as session:
+                await session.execute(update(Job).where(Job.id == job_id).values(attempts=attempts, failed=failed, last_error=repr(e), run_after=datetime.now() + timedelta(seconds=delay)))
+                await session.commit()
+            if not failed:
+                asyncio.get_running_loop().call_later(delay, self.notify, [job_id])
+            return
+        async with self.session_maker() as session:
+            await session.execute(delete(Job).where(Job.id == job_id))
+            await session.commit()
+
+
+job_queue = JobQueue()
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_committed_jobs(session: Session):
+    committed = session.info.pop('enqueued_jobs', None)
+    if committed:
+        job_queue.notify([pending.id for pending in committed])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_jobs(session: Session):
+    session.info.pop('enqueued_jobs', None)
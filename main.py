@@ -1,18 +1,40 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from contextlib import asynccontextmanager
-from .db.db_conn import create_all_tables
+from .db.db_conn import create_all_tables, async_session_maker
+from .db.categories import load_category_map
+from .security.password import configure_password_pool, shutdown_password_pool
+from .security.token_sweeper import token_sweeper
+from .security.cart_cookie import check_cart_cookie_secret
+from .cart_store import cart_store
+from .jobs import job_queue
+from .review_votes import useful_counter
+from .metrics import MetricsMiddleware, render_metrics, METRICS_CONTENT_TYPE
+from .db.query_stats import QueryStatsMiddleware
 from .routers import order, product, review, cart, user
+from .dependencies import TOKEN_COOKIE_NAME
 from starlette_csrf import CSRFMiddleware
 from starlette.middleware.cors import CORSMiddleware
 
 
-TOKEN_COOKIE_NAME='token'
 CSFR_TOKEN_SECRET='my_super_long_and_ultra_secured_csrf_secret_for_iceedge'
 
 @asynccontextmanager
 async def lifespan(app: FastAPI): 
+    check_cart_cookie_secret()
+    configure_password_pool()
     await create_all_tables() 
+    async with async_session_maker() as session: 
+        await load_category_map(session)
+    cart_store.start()
+    job_queue.start()
+    useful_counter.start()
+    token_sweeper.start()
     yield
+    await token_sweeper.stop()
+    await useful_counter.stop()
+    await job_queue.stop()
+    await cart_store.stop()
+    shutdown_password_pool()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -32,10 +54,17 @@ app.add_middleware(
     cookie_domain='localhost'
 )
 
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 @app.get('/hello')
 async def welcome(): 
     return "Welcome to Iceedge, what do you need?"
 
+@app.get('/metrics', include_in_schema=False)
+async def metrics(): 
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 app.include_router(router=product.router)
 app.include_router(router=review.router)
 app.include_router(router=order.router)
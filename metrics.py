@@ -0,0 +1,153 @@
+import threading
+import time
+from bisect import bisect_left
+from .security.token_cache import token_cache
+from .security.token_sweeper import token_sweeper
+from .response_cache import response_cache
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = '<unmatched>'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RouteStats:
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self, size: int):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * size
+
+
+class RequestMetrics:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # in_flight is only touched from the event loop thread, so it needs no lock
+        self.in_flight = 0
+        self._local = threading.local()
+        self._shards: list[dict[tuple, RouteStats]] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict[tuple, RouteStats]:
+        shard = getattr(self._local, 'stats', None)
+        if shard is None:
+            # each thread records into its own shard; the lock is taken once per thread, never per request
+            shard = self._local.stats = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float) -> None:
+        shard = self._shard()
+        key = (method, route, status_code)
+        stats = shard.get(key)
+        if stats is None:
+            stats = shard[key] = RouteStats(len(self.buckets) + 1)
+        stats.count += 1
+        stats.total += seconds
+        stats.buckets[bisect_left(self.buckets, seconds)] += 1
+
+    def snapshot(self) -> dict[tuple, RouteStats]:
+        merged: dict[tuple, RouteStats] = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, stats in list(shard.items()):
+                total = merged.get(key)
+                if total is None:
+                    total = merged[key] = RouteStats(len(self.buckets) + 1)
+                total.count += stats.count
+                total.total += stats.total
+                total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+        return merged
+
+    def reset(self) -> None:
+        with self._shards_lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: RequestMetrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        self.metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.in_flight -= 1
+            # label by route template so /product/1 and /product/2 share a series
+            route = getattr(scope.get('route'), 'path_format', None) or UNMATCHED_ROUTE
+            self.metrics.observe(scope['method'], route, status_code, elapsed)
+
+
+def label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(metrics: RequestMetrics = request_metrics) -> str:
+    stats = metrics.snapshot()
+    lines = [
+        '# HELP http_requests_total Requests served, by route template and status code.',
+        '# TYPE http_requests_total counter',
+    ]
+    by_route: dict[tuple[str, str], RouteStats] = {}
+    for (method, route, status_code), route_stats in sorted(stats.items()):
+        lines.append(f'http_requests_total{{method="{method}",route="{label(route)}",status="{status_code}"}} {route_stats.count}')
+        total = by_route.get((method, route))
+        if total is None:
+            total = by_route[(method, route)] = RouteStats(len(metrics.buckets) + 1)
+        total.count += route_stats.count
+        total.total += route_stats.total
+        total.buckets = [a + b for a, b in zip(total.buckets, route_stats.buckets)]
+
+    lines += [
+        '# HELP http_request_duration_seconds Request latency, by route template.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (method, route), route_stats in by_route.items():
+        labels = f'method="{method}",route="{label(route)}"'
+        cumulative = 0
+        for bound, count in zip(metrics.buckets, route_stats.buckets):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {route_stats.count}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {route_stats.total}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {route_stats.count}')
+
+    lines += [
+        '# HELP http_requests_in_flight Requests currently being served.',
+        '# TYPE http_requests_in_flight gauge',
+        f'http_requests_in_flight {metrics.in_flight}',
+    ]
+    for name, cache in (('token_cache', token_cache), ('response_cache', response_cache)):
+        cache_stats = cache.stats()
+        lines += [
+            f'# TYPE iceedge_{name}_hits_total counter',
+            f'iceedge_{name}_hits_total {cache_stats["hits"]}',
+            f'# TYPE iceedge_{name}_misses_total counter',
+            f'iceedge_{name}_misses_total {cache_stats["misses"]}',
+        ]
+        for key in ('size', 'entries', 'bytes'):
+            if key in cache_stats:
+                lines += [f'# TYPE iceedge_{name}_{key} gauge', f'iceedge_{name}_{key} {cache_stats[key]}']
+    lines += ['# TYPE iceedge_expired_tokens_deleted_total counter', f'iceedge_expired_tokens_deleted_total {token_sweeper.deleted}']
+    return '\n'.join(lines) + '\n'
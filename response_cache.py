@@ -0,0 +1,99 @@
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, NamedTuple
+from fastapi import Request, Response, status
+
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    tags: tuple[str, ...]
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._keys_by_tag: dict[str, set[tuple]] = {}
+        self._invalidated_at: dict[str, int] = {}
+
+    def get(self, key: tuple) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, body: bytes, tags: tuple[str, ...], generation: int) -> CachedResponse:
+        entry = CachedResponse(body, make_etag(body), tags)
+        # skip entries built from data that was invalidated while they were being built
+        if len(body) > self.max_bytes or any(self._invalidated_at.get(tag, -1) > generation for tag in tags):
+            return entry
+        self._discard(key)
+        self._entries[key] = entry
+        self.size += len(body)
+        for tag in tags:
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+        while self.size > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, *tags: str) -> None:
+        self.generation += 1
+        for tag in tags:
+            self._invalidated_at[tag] = self.generation
+            for key in self._keys_by_tag.pop(tag, set()):
+                self._discard(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_tag.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+    def _discard(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry.body)
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+response_cache = ResponseCache()
+
+
+async def cached_json(request: Request, tags: tuple[str, ...], build: Callable[[], Awaitable[bytes]]) -> Response:
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation
+        entry = response_cache.put(key, await build(), tags, generation)
+    if etag_matches(request.headers.get('if-none-match'), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': entry.etag})
+    return Response(content=entry.body, media_type='application/json', headers={'ETag': entry.etag})
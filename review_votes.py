@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from uuid import UUID
+from sqlalchemy import update, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from .db.db_conn import async_session_maker
+from .db.model import Review, ReviewVote
+from .response_cache import response_cache
+
+USEFUL_FLUSH_INTERVAL = 0.25
+USEFUL_SHARDS = 8
+
+logger = logging.getLogger(__name__)
+
+
+class VoteShard:
+    def __init__(self):
+        # review id -> users who marked it useful since the last flush
+        self.votes: dict[int, set[UUID]] = defaultdict(set)
+        self.products: dict[int, int] = {}
+        self.flush_lock = asyncio.Lock()
+
+    def take(self) -> tuple[dict[int, set[UUID]], dict[int, int]]:
+        votes, products = self.votes, self.products
+        self.votes, self.products = defaultdict(set), {}
+        return votes, products
+
+    def restore(self, votes: dict[int, set[UUID]], products: dict[int, int]) -> None:
+        for review_id, users in votes.items():
+            self.votes[review_id] |= users
+        self.products.update(products)
+
+
+# a hot review would otherwise take one write per click; each shard is flushed in its own
+# short transaction and only votes that were not already stored add to num_marked_useful
+class UsefulCounter:
+    def __init__(self, flush_interval: float = USEFUL_FLUSH_INTERVAL, shards: int = USEFUL_SHARDS, session_maker: async_sessionmaker = async_session_maker):
+        self.flush_interval = flush_interval
+        self.session_maker = session_maker
+        self._shards = [VoteShard() for _ in range(shards)]
+        self._task: asyncio.Task | None = None
+
+    def _shard(self, review_id: int) -> VoteShard:
+        return self._shards[review_id % len(self._shards)]
+
+    def add(self, review_id: int, product_id: int, user_id: UUID) -> bool:
+        shard = self._shard(review_id)
+        users = shard.votes[review_id]
+        if user_id in users:
+            return False
+        users.add(user_id)
+        shard.products[review_id] = product_id
+        return True
+
+    def pending(self, review_id: int) -> int:
+        return len(self._shard(review_id).votes.get(review_id, ()))
+
+    def discard(self, review_id: int) -> None:
+        shard = self._shard(review_id)
+        shard.votes.pop(review_id, None)
+        shard.products.pop(review_id, None)
+
+    async def flush_all(self) -> None:
+        for shard in self._shards:
+            try:
+                await self._flush_shard(shard)
+            except Exception:
+                logger.exception('Failed to flush review votes')
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_all()
+
+    async def _flush_shard(self, shard: VoteShard) -> None:
+        async with shard.flush_lock:
+            if not shard.votes:
+                return
+            votes, products = shard.take()
+            now = datetime.now()
+            rows = [{'review_id': review_id, 'user_id': user_id, 'created_at': now} for review_id, users in votes.items() for user_id in users]
+            try:
+                async with self.session_maker() as session:
+                    stmt = sqlite_insert(ReviewVote).on_conflict_do_nothing().returning(ReviewVote.review_id)
+                    deltas: dict[int, int] = defaultdict(int)
+                    for review_id in (await session.execute(stmt, rows)).scalars():
+                        deltas[review_id] += 1
+                    if deltas:
+                        # Core table, so the list of params runs as one executemany rather than an ORM bulk update
+                        reviews = Review.__table__
+                        increment = update(reviews).where(reviews.c.id == bindparam('review_id')).values(num_marked_useful=reviews.c.num_marked_useful + bindparam('delta'))
+                        await session.execute(increment, [{'review_id': review_id, 'delta': delta} for review_id, delta in deltas.items()])
+                    await session.commit()
+            except Exception:
+                # nothing was committed, so put the votes back for the next flush
+                shard.restore(votes, products)
+                raise
+            if deltas:
+                # listings under 'products' can embed reviews along with their counts
+                response_cache.invalidate('products', *{f'product:{products[review_id]}' for review_id in deltas})
+
+
+useful_counter = UsefulCounter()
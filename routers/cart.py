@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from ..db.db_conn import AsyncSession, get_async_session
-from ..db.model import  Product, CartItem, User, Cart 
-from sqlalchemy import select, update, delete 
+from datetime import datetime
+from fastapi import APIRouter, Depends, status, HTTPException, Body, Request, Response
+from ..db.db_conn import AsyncSession, get_async_session, get_read_session
+from ..db.model import  Product, CartItem, User, Cart, Order, OrderItem 
+from sqlalchemy import select, update, delete, insert, func, literal, distinct 
 from sqlalchemy.orm import joinedload
-from ..db.schema import  ItemUpdate
+from ..db.schema import  CartItemSet, Checkout, CheckoutRead, OrderStatus
 from ..dependencies import get_curr_user, Rbac, Role
-from uuid import UUID
+from ..response_cache import response_cache
+from ..cart_store import cart_store, cart_as_dict, CartLine
+from ..security.cart_cookie import CART_COOKIE_NAME, CART_COOKIE_MAX_AGE, CART_COOKIE_MAX_ITEMS, encode_cart, decode_cart
+from uuid import UUID, uuid4
 
 router = APIRouter(prefix='/cart', tags=['cart', 'item'])
 
+SHIPPING_FEE = 1500.0
+
 async def get_cart_by_user(id: UUID, session: AsyncSession = Depends(get_async_session)): 
     q = select(Cart).where(Cart.user_id == id).order_by(Cart.created_at)
     result = (await session.execute(q)).one_or_none()
@@ -31,14 +37,108 @@ async def get_cart_item_or_none(id: int, session: AsyncSession = Depends(get_asy
     return result
 
 
-@router.get('/user/{id}', response_model=Cart) 
+async def checkout_cart(session: AsyncSession, cart_id: int, user: User, shipping_address: str | None) -> CheckoutRead: 
+    num_products = await session.scalar(select(func.count(distinct(CartItem.product_id))).where(CartItem.cart_id == cart_id))
+    if not num_products: 
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Your cart is empty')
+    lines = select(CartItem.product_id, func.sum(CartItem.quantity).label('quantity')).where(CartItem.cart_id == cart_id).group_by(CartItem.product_id).subquery()
+    reserve = update(Product).where(Product.id == lines.c.product_id, Product.amt_left >= lines.c.quantity).values(amt_left=Product.amt_left - lines.c.quantity).returning(Product.id).execution_options(synchronize_session=False)
+    reserved = (await session.execute(reserve)).scalars().all()
+    if len(reserved) != num_products: 
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Some products in your cart do not have enough stock left')
+
+    order_id = uuid4()
+    order_id_literal = literal(order_id, Order.__table__.c.id.type)
+    now = datetime.now()
+    totals = select(
+        order_id_literal, func.sum(CartItem.unit_price * CartItem.quantity) + SHIPPING_FEE, func.sum(CartItem.quantity), literal(SHIPPING_FEE), 
+        literal(OrderStatus.PENDING, Order.__table__.c.status.type), literal(shipping_address or user.address), literal(now), literal(user.id, Order.__table__.c.customer_id.type), 
+    ).where(CartItem.cart_id == cart_id)
+    create_order = insert(Order).from_select(['id', 'total', 'quantity', 'shipping_fee', 'status', 'shipping_address', 'created_at', 'customer_id'], totals).returning(Order.total)
+    total = (await session.execute(create_order)).scalar_one()
+
+    items = select(CartItem.unit_price, CartItem.quantity, CartItem.product_id, literal(now), order_id_literal).where(CartItem.cart_id == cart_id)
+    create_items = insert(OrderItem).from_select(['unit_price', 'quantity', 'product_id', 'created_at', 'order_id'], items).returning(OrderItem.id)
+    item_ids = (await session.execute(create_items)).scalars().all()
+
+    await session.execute(delete(CartItem).where(CartItem.cart_id == cart_id))
+    await session.execute(delete(Cart).where(Cart.id == cart_id))
+    await session.commit()
+    response_cache.invalidate('products', *(f'product:{id}' for id in reserved))
+    return CheckoutRead(order_id=order_id, total=total, order_item_ids=item_ids)
+
+
+def set_cart_cookie(response: Response, lines: dict[int, CartLine]): 
+    if not lines: 
+        response.delete_cookie(CART_COOKIE_NAME)
+        return 
+    response.set_cookie(CART_COOKIE_NAME, encode_cart(lines), max_age=CART_COOKIE_MAX_AGE, samesite='lax', secure=True, httponly=True)
+
+async def materialize_cookie_cart(request: Request, response: Response, user: User): 
+    lines = decode_cart(request.cookies.get(CART_COOKIE_NAME))
+    if lines: 
+        await cart_store.set_items(user.id, lines)
+    if CART_COOKIE_NAME in request.cookies: 
+        response.delete_cookie(CART_COOKIE_NAME)
+
+
+@router.post('/checkout', response_model=CheckoutRead, status_code=status.HTTP_201_CREATED)
+async def checkout(request: Request, response: Response, details: Checkout = Body(Checkout()), user: User = Depends(get_curr_user), session: AsyncSession = Depends(get_async_session)): 
+    await materialize_cookie_cart(request, response, user)
+    cart_id = await cart_store.flush(user.id)
+    if cart_id is None: 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='You do not have a cart')
+    result = await checkout_cart(session, cart_id, user, details.shipping_address)
+    cart_store.discard(user.id)
+    return result
+
+
+@router.get('/anonymous')
+async def get_anonymous_cart(request: Request): 
+    return cart_as_dict(None, decode_cart(request.cookies.get(CART_COOKIE_NAME)))
+
+@router.put('/anonymous/items/{product_id}')
+async def set_anonymous_cart_item(product_id: int, item: CartItemSet, request: Request, response: Response, session: AsyncSession = Depends(get_read_session)): 
+    lines = decode_cart(request.cookies.get(CART_COOKIE_NAME))
+    if product_id not in lines and len(lines) >= CART_COOKIE_MAX_ITEMS: 
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'A cart can hold at most {CART_COOKIE_MAX_ITEMS} products, sign in to add more')
+    price = await session.scalar(select(Product.price).where(Product.id == product_id))
+    if price is None: 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Product not found')
+    lines[product_id] = CartLine(item.quantity, price)
+    set_cart_cookie(response, lines)
+    return cart_as_dict(None, lines)
+
+@router.delete('/anonymous/items/{product_id}')
+async def delete_anonymous_cart_item(product_id: int, request: Request, response: Response): 
+    lines = decode_cart(request.cookies.get(CART_COOKIE_NAME))
+    if lines.pop(product_id, None) is None: 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Product is not in your cart')
+    set_cart_cookie(response, lines)
+    return cart_as_dict(None, lines)
+
+
+@router.get('/user/{id}') 
 async def get_cart_by_user_id(cart: Cart = Depends(get_cart_by_user)): 
     return cart 
 
 @router.get('/my_cart')
 async def get_current_user_cart(user: User = Depends(get_curr_user)): 
-    result = await get_cart_by_user(user.id)
-    return result 
+    return await cart_store.get(user.id)
+
+@router.put('/my_cart/items/{product_id}')
+async def set_my_cart_item(product_id: int, item: CartItemSet, user: User = Depends(get_curr_user), session: AsyncSession = Depends(get_read_session)): 
+    price = await session.scalar(select(Product.price).where(Product.id == product_id))
+    if price is None: 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Product not found')
+    await cart_store.set_item(user.id, product_id, item.quantity, price)
+    return await cart_store.get(user.id)
+
+@router.delete('/my_cart/items/{product_id}', status_code=status.HTTP_204_NO_CONTENT)
+async def delete_my_cart_item(product_id: int, user: User = Depends(get_curr_user)): 
+    if not await cart_store.remove_item(user.id, product_id): 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Product is not in your cart')
 
 # TODO: For developer only
 @router.get('/', dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)])
@@ -49,21 +149,3 @@ async def get_all_carts(session: AsyncSession = Depends(get_async_session)):
 @router.get('/{id}') 
 async def get_cart_by_id(cart: Cart = Depends(get_cart_or_none)): 
     return cart
-
-@router.patch('/item/{id}')
-async def update_item(id: int, updates: ItemUpdate, session: AsyncSession = Depends(get_async_session)): 
-    if not updates: 
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='There should be at least tan updated field')
-    q = update(CartItem).where(CartItem.id == id).values(**updates.model_dump(exclude_unset=True))  
-    res = await session.execute(q) 
-    if res.rowcount == 0: 
-        return False 
-    return True 
-
-@router.delete('/item/{id}', status_code=status.HTTP_204_NO_CONTENT)
-async def delete_item(id: int, session: AsyncSession = Depends(get_async_session)): 
-    q = delete(CartItem).where(CartItem.id == id)
-    res = await session.execute(q)
-    if res.rowcount == 0: 
-        return False 
-    return True 
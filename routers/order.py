@@ -1,15 +1,27 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from ..db.db_conn import AsyncSession, get_async_session
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Literal
+from fastapi import APIRouter, Depends, status, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from ..db.db_conn import AsyncSession, get_async_session, get_read_session
 from ..db.model import  Product, OrderItem, User, Order
 from sqlalchemy import select, update, delete 
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload, lazyload
 from ..dependencies import get_curr_user, Rbac
-from ..db.schema import Role, OrderRead, OrderCreate
+from ..db.schema import Role, OrderRead, OrderCreate, OrderStatus
 from uuid import UUID
+from ..response_cache import response_cache
+from ..serialization import json_response, rows_as_dicts
 # from .product import get_product_or_404
 
 router = APIRouter(prefix='/order', tags=['order', 'item'], dependencies=[Depends(get_curr_user)])
 
+EXPORT_YIELD_PER = 500
+ORDER_LIST_COLUMNS = (Order.id, Order.customer_id, Order.status, Order.total, Order.quantity, Order.shipping_fee, Order.shipping_address, Order.created_at)
+EXPORT_CSV_COLUMNS = ['order_id', 'customer_id', 'status', 'total', 'shipping_fee', 'shipping_address', 'created_at', 'product_id', 'quantity', 'unit_price']
+
 async def get_item_or_404(id: int, session: AsyncSession = Depends(get_async_session)) -> OrderItem: 
     result = (await  session.scalars(select(OrderItem).where(OrderItem.id == id))).one_or_none()
     if not result: 
@@ -24,38 +36,98 @@ async def check_if_user_purchase_prod(customer_id: UUID, prod_id: int, session:
     return result
     
 
-async def get_order_or_404(id: int, session: AsyncSession = Depends(get_async_session)) -> Order: 
+async def get_order_or_404(id: int, session: AsyncSession = Depends(get_read_session)) -> Order: 
     result = (await session.scalars(select(Order, OrderItem ).where(Order.id == id).options(joinedload(Order.order_items)))).one_or_none() 
     if not result: 
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Order not found')
     return result
 
-async def get_user_orders_or_404(id: UUID, session: AsyncSession = Depends(get_async_session)): 
+async def get_user_orders_or_404(id: UUID, session: AsyncSession = Depends(get_read_session)): 
     result = (await session.scalars(select(Order).where(Order.customer_id == id).options(joinedload(Order.order_items)))).all() 
     if not result: 
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Order not found')
     return result
   
+def order_as_dict(order: Order) -> dict: 
+    return {
+        'id': str(order.id), 'customer_id': str(order.customer_id), 'status': getattr(order.status, 'value', order.status), 
+        'total': order.total, 'shipping_fee': order.shipping_fee, 'shipping_address': order.shipping_address, 
+        'created_at': order.created_at.isoformat(), 
+        'items': [{'product_id': item.product_id, 'quantity': item.quantity, 'unit_price': item.unit_price} for item in order.order_items], 
+    }
+
+def orders_as_ndjson(orders: list[Order]) -> str: 
+    return ''.join(json.dumps(order_as_dict(order)) + '\n' for order in orders)
+
+def orders_as_csv(orders: list[Order]) -> str: 
+    buffer = io.StringIO() 
+    writer = csv.writer(buffer)
+    for order in orders: 
+        data = order_as_dict(order)
+        head = [data['id'], data['customer_id'], data['status'], data['total'], data['shipping_fee'], data['shipping_address'], data['created_at']]
+        for item in data['items'] or [{'product_id': '', 'quantity': '', 'unit_price': ''}]: 
+            writer.writerow(head + [item['product_id'], item['quantity'], item['unit_price']])
+    return buffer.getvalue()
+
+async def stream_orders(session: AsyncSession, criteria: list, format: str) -> AsyncIterator[str]: 
+    encode = orders_as_csv if format == 'csv' else orders_as_ndjson
+    if format == 'csv': 
+        yield ','.join(EXPORT_CSV_COLUMNS) + '\r\n'
+    q = select(Order).where(*criteria).order_by(Order.created_at, Order.id).options(selectinload(Order.order_items).options(lazyload(OrderItem.product))).execution_options(yield_per=EXPORT_YIELD_PER)
+    result = await session.stream_scalars(q)
+    async for orders in result.partitions(): 
+        yield encode(orders)
+
 # @router.get('/items/{id}', response_model=OrderItem) 
 # async def get_item_by_id(item: OrderItem = Depends(get_item_or_404), session: AsyncSession = Depends(get_async_session)):
 #     return item
 
+async def reserve_stock(session: AsyncSession, quantities: dict[int, int]) -> int | None: 
+    for product_id, quantity in sorted(quantities.items()): 
+        q = update(Product).where(Product.id == product_id, Product.amt_left >= quantity).values(amt_left=Product.amt_left - quantity)
+        if (await session.execute(q)).rowcount == 0: 
+            return product_id
+    return None
+
 @router.post('/', status_code=status.HTTP_201_CREATED)
-async def create_new_order( user: User, new_item: OrderCreate, session: AsyncSession = Depends(get_async_session) ): 
-    if not new_item.customer_id: 
-        new_item.customer_id = user.id
-    order = Order(**new_item.model_dump(exclude_unset=True))
+async def create_new_order( new_item: OrderCreate, user: User = Depends(get_curr_user), session: AsyncSession = Depends(get_async_session) ): 
+    quantities: dict[int, int] = {}
+    for item in new_item.order_items: 
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    unavailable = await reserve_stock(session, quantities)
+    if unavailable is not None: 
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f'Product {unavailable} does not have enough stock left')
+    order = Order(
+        total=new_item.total, quantity=sum(quantities.values()), shipping_fee=new_item.shipping_fee, shipping_address=new_item.shipping_address, 
+        status=new_item.order_status, created_at=new_item.created_at, customer_id=user.id, 
+        order_items=[OrderItem(product_id=item.product_id, quantity=item.quantity, unit_price=item.unit_price) for item in new_item.order_items], 
+    )
     session.add(order) 
     await session.commit()
+    response_cache.invalidate('products', *(f'product:{id}' for id in quantities))
     return order
 
 
 # TODO: Only Admins and Developer
-@router.get('/', dependencies=[ Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)], response_model=list[OrderItem])
-async def get_all_items(session: AsyncSession = Depends(get_async_session)): 
-    result = (await session.scalars(select(Order).order_by(Order.created_at))).all() 
-    return result
+@router.get('/', dependencies=[ Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)])
+async def get_all_items(session: AsyncSession = Depends(get_read_session)): 
+    rows = (await session.execute(select(*ORDER_LIST_COLUMNS).order_by(Order.created_at, Order.id))).mappings()
+    return json_response(rows_as_dicts(rows))
+
 
+@router.get('/export', dependencies=[ Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)])
+async def export_orders(format: Literal['ndjson', 'csv'] = Query('ndjson'), start: datetime | None = Query(None), end: datetime | None = Query(None), order_status: OrderStatus | None = Query(None, alias='status'), session: AsyncSession = Depends(get_read_session, scope='request')): 
+    criteria = []
+    if start: 
+        criteria.append(Order.created_at >= start)
+    if end: 
+        criteria.append(Order.created_at < end)
+    if order_status: 
+        criteria.append(Order.status == order_status)
+    media_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    # the request scoped session stays open until the body has been streamed
+    return StreamingResponse(stream_orders(session, criteria, format), media_type=media_type, headers={'Content-Disposition': f'attachment; filename="orders.{format}"'})
     
 @router.get('/{id}', response_model=OrderRead)
 async def get_items_by_order( order: Order = Depends(get_order_or_404)): 
@@ -68,6 +140,6 @@ async def get_order_by_user(order = Depends(get_user_orders_or_404)):
 
 
 @router.get('/my_orders')
-async def get_current_users_orders(user: User = Depends(get_curr_user)): 
-    results = await get_user_orders_or_404(user.id) 
+async def get_current_users_orders(user: User = Depends(get_curr_user), session: AsyncSession = Depends(get_read_session)): 
+    results = await get_user_orders_or_404(user.id, session) 
     return  results
@@ -1,86 +1,192 @@
-from fastapi import APIRouter, Depends, status, HTTPException, Body, Query, Path
-from sqlalchemy import select, update, delete, func
-from sqlalchemy.orm import joinedload
-from ..db.model import Category, Product, User 
+from fastapi import APIRouter, Depends, status, HTTPException, Body, Query, Path, Request
+from sqlalchemy import select, update, delete, func, cast, Integer
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.exc import IntegrityError
+from ..db.model import Category, Product, Review, User 
 from datetime import datetime
 from ..dependencies import get_curr_user, Rbac
-from ..db.db_conn import AsyncSession, get_async_session
-from typing import Sequence
-from ..db.schema import ProductCreate, ProductRead, ProductUpdate, Message, Cat, Role
+from ..db.db_conn import AsyncSession, get_async_session, get_read_session
+from ..db.schema import ProductCreate, ProductRead, ProductSummary, ProductSummaryPage, ProductUpdate, ReviewSummary, Message, Cat, Role
+from ..db.categories import category_id
+from ..db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_cursor, decode_cursor, next_cursor
+from ..db.product_import import IMPORT_BATCH_SIZE, IMPORT_MAX_BATCH_SIZE, import_products, iter_lines, iter_csv_rows, iter_ndjson_rows
+from ..db.search import ranked_products, match_expression
+from ..response_cache import response_cache, cached_json
+from ..serialization import dumps, json_response
 
 router = APIRouter(prefix='/products', tags=['products'])
 
-async def  get_category_by_name(name: Cat, session: AsyncSession = Depends(get_async_session)) -> Category: 
-    query = select(Category).where(Category.name == name)
-    return (await session.execute(query)).scalar_one() 
+# the ProductRead fields as plain columns, so list pages skip the ORM and pydantic entirely
+PRODUCT_LIST_COLUMNS = (
+    Product.id, Product.name, Product.description, Product.price, cast(Product.discount, Integer).label('discount'), 
+    Product.thumbnail, Product.gallery, Product.amt_left, Product.created_at, Product.avg_rating, Product.ratings_count, Category.name.label('cat'), 
+)
+PRODUCT_FIELDS = {column.key: column for column in PRODUCT_LIST_COLUMNS}
+PRODUCT_SUMMARY_FIELDS = tuple(ProductSummary.model_fields)
+PRODUCT_DETAIL_FIELDS = tuple(PRODUCT_FIELDS)
+REVIEW_SUMMARY_COLUMNS = tuple(getattr(Review, name) for name in ReviewSummary.model_fields)
+MAX_EMBEDDED_REVIEWS = 5
+FIELDS_DESCRIPTION = 'Comma-separated product fields to return; add reviews to embed the newest reviews'
+
+def parse_fields(fields: str | None, default: tuple[str, ...]) -> tuple[str, ...]: 
+    if not fields: 
+        return default
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in PRODUCT_FIELDS and field != 'reviews']
+    if unknown: 
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    # id is always returned, it is what clients follow up with
+    return tuple(dict.fromkeys(['id', *requested]))
+
+def list_fields(fields: str | None = Query(None, description=FIELDS_DESCRIPTION)) -> tuple[str, ...]: 
+    return parse_fields(fields, PRODUCT_SUMMARY_FIELDS)
+
+def detail_fields(fields: str | None = Query(None, description=FIELDS_DESCRIPTION)) -> tuple[str, ...]: 
+    return parse_fields(fields, PRODUCT_DETAIL_FIELDS)
 
+def select_product_rows(fields: tuple[str, ...] = PRODUCT_DETAIL_FIELDS, *extra): 
+    # only the requested columns are read; the keyset columns ride along for the cursor
+    columns = [PRODUCT_FIELDS[field] for field in fields if field in PRODUCT_FIELDS and field not in ('id', 'created_at')]
+    q = select(Product.id, Product.created_at, *columns, *extra)
+    if 'cat' in fields: 
+        q = q.join(Category, Product.cat_id == Category.id)
+    return q
 
-async def get_prods_by_cat(cat: Cat, session: AsyncSession = Depends(get_async_session)) -> Sequence[Product]: 
-    cat_id = (await get_category_by_name(cat)).id 
-    q = select(Product, Category.name).where(Product.cat_id == cat_id).join(Product.cat).order_by(Product.created_at).options(joinedload(Product.cat))
-    return (await session.scalars(q)).all() 
+def product_rows_as_dicts(rows: list[RowMapping], fields: tuple[str, ...]) -> list[dict]: 
+    keys = [field for field in fields if field in PRODUCT_FIELDS]
+    return [{key: row[key] for key in keys} for row in rows]
 
-async def get_product_or_404(id: int, session: AsyncSession = Depends(get_async_session)) -> Product | None : 
-    q = select(Product, Category.name).where(Product.id == id).options(joinedload(Product.cat))
-    res = (await session.execute(q)).scalar_one_or_none() 
-    if not res: 
+async def embed_reviews(session: AsyncSession, products: list[dict]) -> None: 
+    # one IN query for the whole page, like selectinload, but capped per product
+    if not products: 
+        return
+    position = func.row_number().over(partition_by=Review.product_id, order_by=(Review.created_at.desc(), Review.id.desc())).label('position')
+    ranked = select(Review.product_id, *REVIEW_SUMMARY_COLUMNS, position).where(Review.product_id.in_([p['id'] for p in products])).subquery()
+    q = select(ranked).where(ranked.c.position <= MAX_EMBEDDED_REVIEWS).order_by(ranked.c.product_id, ranked.c.position)
+    reviews: dict[int, list[dict]] = {}
+    for row in (await session.execute(q)).mappings(): 
+        reviews.setdefault(row['product_id'], []).append({column.key: row[column.key] for column in REVIEW_SUMMARY_COLUMNS})
+    for product in products: 
+        product['reviews'] = reviews.get(product['id'], [])
+
+async def paginate_products(session: AsyncSession, cursor: str | None, limit: int, fields: tuple[str, ...], *criteria) -> tuple[list[dict], str | None]: 
+    q = select_product_rows(fields).where(*criteria).order_by(Product.created_at, Product.id).limit(limit + 1)
+    if cursor: 
+        q = q.where(after_cursor((Product.created_at, Product.id), decode_cursor(cursor, datetime, int)))
+    rows = list((await session.execute(q)).mappings())
+    cursor = next_cursor(rows, limit, lambda p: (p['created_at'], p['id']))
+    products = product_rows_as_dicts(rows, fields)
+    if 'reviews' in fields: 
+        await embed_reviews(session, products)
+    return products, cursor
+
+async def get_prods_by_cat(cat: Cat, cursor: str | None = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: tuple[str, ...] = Depends(list_fields), session: AsyncSession = Depends(get_read_session)) -> dict: 
+    products, cursor = await paginate_products(session, cursor, limit, fields, Product.cat_id == category_id(cat))
+    return {'items': products, 'next_cursor': cursor}
+
+async def get_product_or_404(id: int, fields: tuple[str, ...] = PRODUCT_DETAIL_FIELDS, session: AsyncSession = Depends(get_read_session)) -> dict | None : 
+    row = (await session.execute(select_product_rows(fields).where(Product.id == id))).mappings().one_or_none()
+    if not row: 
         return None  
-    return res
+    product = product_rows_as_dicts([row], fields)[0]
+    if 'reviews' in fields: 
+        await embed_reviews(session, [product])
+    return product
     
-async def get_products(skip: int = Query(0), limit: int = Query(None, max=100, min=1), session: AsyncSession = Depends(get_async_session)):
-    q = select(Product).order_by(Product.created_at).offset(skip).limit(limit)
-    return (await session.scalars(q)).all() 
+async def get_products(cursor: str | None = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: tuple[str, ...] = Depends(list_fields), session: AsyncSession = Depends(get_read_session)) -> dict:
+    products, cursor = await paginate_products(session, cursor, limit, fields)
+    return {'items': products, 'next_cursor': cursor}
 
-
-@router.post('/', dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)] ,status_code=status.HTTP_201_CREATED,  response_model=ProductRead,responses={ status.HTTP_409_CONFLICT: {"model": Message()} }, 
+@router.post('/', dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)] ,status_code=status.HTTP_201_CREATED,  response_model=ProductRead,responses={ status.HTTP_409_CONFLICT: {"model": Message} }, 
 )
 async def add_new_prod(new_product: ProductCreate =  Body(example=ProductCreate(name="Product name", price=9999.99,description="product description" ,discount=10, cat=Cat.SHIRT, thumbnail='product_thumbnail.jpg', amt_left=5, gallery=['second_img.jpg', 'first_img.jpg'], created_at=datetime.now() )), session: AsyncSession = Depends(get_async_session)): 
-    fetched_cat = await get_category_by_name(new_product.cat) 
-    product = Product(**new_product.model_dump(exclude_unset=True), cat=fetched_cat)
-    session.add(product) 
-    await session.commit()   
-    return product
+    product = Product(**new_product.model_dump(exclude_unset=True, exclude={'cat'}), cat_id=category_id(new_product.cat))
+    try: 
+        session.add(product) 
+        await session.commit()   
+    except IntegrityError: 
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='A product with this name already exists')
+    response_cache.invalidate('products')
+    # read back as a row, the ORM object only carries cat_id and would lazy load cat on serialization
+    return await get_product_or_404(product.id, PRODUCT_DETAIL_FIELDS, session)
 
 
-@router.get('/', response_model=list[ProductRead])
-async def get_all_products(): 
-    products = await get_products()
-    return products
+@router.post('/import', dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)])
+async def import_products_stream(request: Request, batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=IMPORT_MAX_BATCH_SIZE), session: AsyncSession = Depends(get_async_session)): 
+    lines = iter_lines(request.stream())
+    content_type = request.headers.get('content-type', '')
+    rows = iter_csv_rows(lines) if content_type.startswith('text/csv') else iter_ndjson_rows(lines)
+    report = await import_products(session, rows, batch_size)
+    if report['inserted']: 
+        response_cache.invalidate('products')
+    return report
 
-@router.get('/{id}', response_model=ProductRead)
-async def get_product_by_id(product: Product = Depends(get_product_or_404)): 
-    return product
 
-@router.get('/{cat}')
-async def get_products_by_category(cat: Cat = Query(example=Cat.SHIRT), session: AsyncSession = Depends(get_async_session)): 
-    category = await get_category_by_name(cat)
-    q = select(Product).where(Product.cat_id == category.id)
-    return (await session.scalars(q)).all()      
+@router.get('/', response_model=ProductSummaryPage)
+async def get_all_products(request: Request, cursor: str | None = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: tuple[str, ...] = Depends(list_fields), session: AsyncSession = Depends(get_read_session)): 
+    async def build() -> bytes: 
+        return dumps(await get_products(cursor, limit, fields, session))
+    return await cached_json(request, ('products',), build)
+
+@router.get('/search', response_model=ProductSummaryPage)
+async def search_products(q: str = Query(..., min_length=1, max_length=200), cursor: str | None = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: tuple[str, ...] = Depends(list_fields), session: AsyncSession = Depends(get_read_session)): 
+    match = match_expression(q)
+    if not match: 
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Search query must contain at least one word')
+    rank = (ranked_products.c.score, ranked_products.c.id)
+    stmt = select_product_rows(fields, ranked_products.c.score).join(ranked_products, Product.id == ranked_products.c.id).order_by(*rank).limit(limit + 1)
+    if cursor: 
+        stmt = stmt.where(after_cursor(rank, decode_cursor(cursor, float, int)))
+    rows = list((await session.execute(stmt, {'match': match})).mappings())
+    cursor = next_cursor(rows, limit, lambda row: (row['score'], row['id']))
+    items = product_rows_as_dicts(rows, fields)
+    if 'reviews' in fields: 
+        await embed_reviews(session, items)
+    return json_response({'items': items, 'next_cursor': cursor})
+
+@router.get('/{id:int}', response_model=ProductRead)
+async def get_product_by_id(request: Request, id: int, fields: tuple[str, ...] = Depends(detail_fields), session: AsyncSession = Depends(get_read_session)): 
+    async def build() -> bytes: 
+        product = await get_product_or_404(id, fields, session)
+        if not product: 
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Product not found')
+        return dumps(product)
+    return await cached_json(request, (f'product:{id}',), build)
 
 @router.get('/group_by_cat')
-async def get_products_group_by_cat(session: AsyncSession = Depends(get_async_session)): 
-    q = select(Product, Category.name.label('category'), func.count(Product.id).label('num_products')).join(Category.products).group_by(Category.name).order_by(Category.name)
-    return (await session.execute(q)).all()
+async def get_products_group_by_cat(session: AsyncSession = Depends(get_read_session)): 
+    q = select(Category.name.label('category'), func.count(Product.id).label('num_products')).join(Category.products).group_by(Category.name).order_by(Category.name)
+    return json_response([dict(row) for row in (await session.execute(q)).mappings()])
+
+@router.get('/{cat}', response_model=ProductSummaryPage)
+async def get_products_by_category(request: Request, cat: Cat, cursor: str | None = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), fields: tuple[str, ...] = Depends(list_fields), session: AsyncSession = Depends(get_read_session)): 
+    async def build() -> bytes: 
+        return dumps(await get_prods_by_cat(cat, cursor, limit, fields, session))
+    return await cached_json(request, ('products',), build)
 
 #TODO: For admins and merchants only
-@router.patch('/{id}' , dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)], status_code=status.HTTP_200_OK)
+@router.patch('/{id:int}' , dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)], status_code=status.HTTP_200_OK)
 async def update_product(id: int,  prod_updates: ProductUpdate = Body(...), session: AsyncSession = Depends(get_async_session)) -> bool:
     if not prod_updates: 
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You must update at least a field")
-    q =  update(Product).where(Product.id == id).values(**prod_updates.model_dump( exclude_unset=True ))
+    values = prod_updates.model_dump( exclude_unset=True )
+    if 'category' in values: 
+        values['cat_id'] = category_id(values.pop('category'))
+    q =  update(Product).where(Product.id == id).values(**values)
     res = await session.execute(q)
     await session.commit() 
+    response_cache.invalidate(f'product:{id}', 'products')
     if res.rowcount == 0: 
         return False 
     return True 
 
 # TODO: For admins and merchants only
-@router.delete('/{id}',dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)] ,status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product(id: int, session: AsyncSession = Depends(get_async_session)) -> bool: 
+@router.delete('/{id:int}',dependencies=[ Depends(get_curr_user), Depends(Rbac(role=[Role.DEVELOPER, Role.MERCHANT]).accessible_to)] ,status_code=status.HTTP_204_NO_CONTENT)
+async def delete_product(id: int, session: AsyncSession = Depends(get_async_session)): 
     q =  delete(Product).where(Product.id == id) 
     res = await session.execute(q)
     await session.commit() 
+    response_cache.invalidate(f'product:{id}', 'products')
     if res.rowcount == 0: 
-        return False 
-    return True 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
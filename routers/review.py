@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, status, Body, HTTPException, Path
+from datetime import datetime
+from typing import Literal
+from fastapi import APIRouter, Depends, status, Body, HTTPException, Path, Query
 from ..db.schema import ReviewCreate, ReviewRead, ReviewUpdate, Role
-from ..db.db_conn import AsyncSession, get_async_session
-from ..db.model import Review, Product, User
-from sqlalchemy import select, update, delete, func 
-from .product import get_product_or_404
+from ..db.db_conn import AsyncSession, get_async_session, get_read_session
+from ..db.model import Review, ReviewVote, Product, User
+from ..db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_cursor, decode_cursor, next_cursor
+from sqlalchemy import select, update, delete, case 
+from sqlalchemy.orm import joinedload
 from .order import check_if_user_purchase_prod
 from .user import get_curr_user
 from sqlalchemy.exc import IntegrityError
+from ..response_cache import response_cache
+from ..serialization import json_response
+from ..review_votes import useful_counter
 
 router = APIRouter(prefix='/review', tags=['reviews'])
 
@@ -19,23 +25,49 @@ async def check_if_mine(id: int, user: User, session: AsyncSession = Depends(get
     return review
 
 
-async def get_review_or_404(id: int, session: AsyncSession = Depends(get_async_session)): 
-    result = (await session.scalars(select(Review).where(Review.id == id))).one_or_none() 
+def update_product_rating(product_id: int, added: float | None = None, removed: float | None = None): 
+    new_count = Product.ratings_count + int(added is not None) - int(removed is not None)
+    new_total = Product.avg_rating * Product.ratings_count + (added or 0) - (removed or 0)
+    return update(Product).where(Product.id == product_id).values(ratings_count=new_count, avg_rating=case((new_count > 0, new_total / new_count), else_=0))
+
+
+REVIEW_LIST_COLUMNS = (Review.id, Review.content, Review.rating, Review.num_marked_useful, Review.created_at, Review.product_id)
+REVIEW_AUTHOR_COLUMNS = (User.id.label('user_id'), User.firstname.label('user_firstname'), User.lastname.label('user_lastname'), User.role.label('user_role'))
+
+# sort mode -> (sort key, its cursor type); ties break on id, newest id first
+REVIEW_SORTS = {
+    'newest': (Review.created_at, datetime),
+    'most_useful': (Review.num_marked_useful, int),
+    'highest_rating': (Review.rating, float),
+}
+
+def review_as_dict(row) -> dict: 
+    review = {column.key: row[column.key] for column in REVIEW_LIST_COLUMNS}
+    review['user'] = {'id': row['user_id'], 'firstname': row['user_firstname'], 'lastname': row['user_lastname'], 'role': row['user_role']}
+    return review
+
+
+async def get_review_or_404(id: int, session: AsyncSession = Depends(get_read_session)): 
+    result = (await session.scalars(select(Review).where(Review.id == id).options(joinedload(Review.user)))).one_or_none() 
     if not result: 
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Review you requested is not found!')
     return result
 
 @router.get('/product/{id}')
-async def get_reviews_by_prod(id: int, session: AsyncSession = Depends(get_async_session)): 
-    if not (await get_product_or_404(id, session)):
+async def get_reviews_by_prod(id: int, sort: Literal['newest', 'most_useful', 'highest_rating'] = Query('newest'), cursor: str | None = Query(None), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), session: AsyncSession = Depends(get_read_session)): 
+    if not (await session.scalar(select(Product.id).where(Product.id == id))):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    review_count = func.count(Review.id).label(None) 
-    q = select(Product.name, Review, review_count).where(Product.id == id).join(Product.reviews).order_by(Review.created_at, Product.name) 
-    res = (await session.scalars(q)).all()
-    return res 
+    sort_key, cursor_type = REVIEW_SORTS[sort]
+    keyset = (sort_key, Review.id)
+    q = select(*REVIEW_LIST_COLUMNS, *REVIEW_AUTHOR_COLUMNS).join(User, Review.user_id == User.id).where(Review.product_id == id).order_by(sort_key.desc(), Review.id.desc()).limit(limit + 1) 
+    if cursor: 
+        q = q.where(after_cursor(keyset, decode_cursor(cursor, cursor_type, int), descending=True))
+    rows = list((await session.execute(q)).mappings())
+    cursor = next_cursor(rows, limit, lambda row: (row[sort_key.key], row['id']))
+    return json_response({'items': [review_as_dict(row) for row in rows], 'next_cursor': cursor})
 
-@router.post('/', dependencies=[Depends(get_curr_user)] ,response_model=ReviewRead, status_code=status.HTTP_201_CREATED)
-async def create_post(user: User, new_review: ReviewCreate = Body(..., example=ReviewCreate(content="The best", rating=5.0, product_id=999)), session: AsyncSession = Depends(get_async_session)): 
+@router.post('/', response_model=ReviewRead, status_code=status.HTTP_201_CREATED)
+async def create_post(user: User = Depends(get_curr_user), new_review: ReviewCreate = Body(..., example=ReviewCreate(content="The best", rating=5.0, product_id=999)), session: AsyncSession = Depends(get_async_session)): 
     new_review.user_id = user.id 
     product_purchase = await check_if_user_purchase_prod(user.id, new_review.product_id, session) 
     if not product_purchase: 
@@ -43,33 +75,52 @@ async def create_post(user: User, new_review: ReviewCreate = Body(..., example=R
     review = Review(**new_review.model_dump(exclude_unset=True))
     try: 
         session.add(review)
+        await session.execute(update_product_rating(review.product_id, added=review.rating))
         await session.commit() 
-        return review
     except IntegrityError: 
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Review already exist')
+    response_cache.invalidate(f'product:{review.product_id}', 'products')
+    # load the author eagerly, ReviewRead would otherwise lazy load it outside the greenlet
+    return await session.scalar(select(Review).where(Review.id == review.id).options(joinedload(Review.user)))
 
 @router.get('/{id}', response_model=ReviewRead)
 async def get_review(review: Review = Depends(get_review_or_404)): 
     return review
 
-@router.patch('/{id}', dependencies=[Depends(get_curr_user)])
-async def update_review( user: User, id: int = Path(...) , updates: ReviewUpdate = Body(example=ReviewUpdate(rating=5.0, content='new rating')), session: AsyncSession = Depends(get_async_session)): 
-    await check_if_mine(id, user, session)
+@router.post('/{id}/useful', status_code=status.HTTP_202_ACCEPTED)
+async def mark_useful(id: int = Path(...), user: User = Depends(get_curr_user), session: AsyncSession = Depends(get_read_session)): 
+    review = (await session.execute(select(Review.product_id, Review.num_marked_useful).where(Review.id == id))).one_or_none()
+    if not review: 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Review you requested is not found!')
+    voted = await session.scalar(select(ReviewVote.review_id).where(ReviewVote.review_id == id, ReviewVote.user_id == user.id))
+    if voted or not useful_counter.add(id, review.product_id, user.id): 
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='You already marked this review useful')
+    # the stored count lags by at most one flush interval
+    return {'id': id, 'num_marked_useful': review.num_marked_useful + useful_counter.pending(id)}
+
+@router.patch('/{id}')
+async def update_review(id: int = Path(...), user: User = Depends(get_curr_user), updates: ReviewUpdate = Body(example=ReviewUpdate(rating=5.0, content='new rating')), session: AsyncSession = Depends(get_async_session)): 
+    review = await check_if_mine(id, user, session)
     if not updates: 
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='You must at least update a field!')
+    old_rating = review.rating 
     q = update(Review).where(Review.id == id).values(**updates.model_dump(exclude_unset=True))
-    result = (await session.execute(q) ).scalar_one() 
+    result = await session.execute(q) 
+    if updates.rating is not None and updates.rating != old_rating: 
+        await session.execute(update_product_rating(review.product_id, added=updates.rating, removed=old_rating))
     await session.commit() 
+    response_cache.invalidate(f'product:{review.product_id}', 'products')
     if result.rowcount == 0: 
         return False 
     return True 
 
-@router.delete('/{id}',  dependencies=[Depends(get_curr_user)] , status_code=status.HTTP_204_NO_CONTENT) 
-async def delete_review( user: User ,id: int = Path(...), session: AsyncSession = Depends(get_async_session)): 
-    await check_if_mine(id, user, session)
+@router.delete('/{id}', status_code=status.HTTP_204_NO_CONTENT) 
+async def delete_review(id: int = Path(...), user: User = Depends(get_curr_user), session: AsyncSession = Depends(get_async_session)): 
+    review = await check_if_mine(id, user, session)
     q = delete(Review).where(Review.id == id) 
-    result = await session.execute(q) 
+    await session.execute(q) 
+    await session.execute(delete(ReviewVote).where(ReviewVote.review_id == id))
+    await session.execute(update_product_rating(review.product_id, removed=review.rating))
     await session.commit() 
-    if result.rowcount == 0: 
-        return False 
-    return True 
+    useful_counter.discard(id)
+    response_cache.invalidate(f'product:{review.product_id}', 'products') 
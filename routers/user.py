@@ -1,16 +1,18 @@
-from fastapi import APIRouter, Form, Depends, status, HTTPException, Body, Query, Path, Response
-from sqlalchemy import select
+from fastapi import APIRouter, Form, Depends, status, HTTPException, Body, Query, Path, Request, Response
+from sqlalchemy import select, update
 from sqlalchemy.orm import joinedload
-from ..db.model import User, AccessToken
+from ..db.model import User, AccessToken, hash_token
 from sqlalchemy.exc import IntegrityError
 from fastapi.security import OAuth2PasswordRequestForm, APIKeyCookie
-from ..security.password import hash_password
-from ..db.schema import UserCreate, Message, UserRead, Credential
+from ..security.password import hash_password_async
+from ..db.schema import UserCreate, Message, UserRead, Credential, Role, Token
 from datetime import datetime, timezone
-from ..db.db_conn import AsyncSession, get_async_session
+from ..db.db_conn import AsyncSession, get_async_session, get_read_session
 from ..security.authenticate import authenticate, create_access_token
-from ..main import TOKEN_COOKIE_NAME
-from ..dependencies import get_curr_user
+from ..dependencies import get_curr_user, Rbac, TOKEN_COOKIE_NAME
+from ..security.token_cache import token_cache
+from uuid import UUID
+from .cart import materialize_cookie_cart
 
 
 router = APIRouter(prefix='/user', tags=['users', 'authentication']) 
@@ -18,8 +20,8 @@ router = APIRouter(prefix='/user', tags=['users', 'authentication'])
 
 @router.post('/register', response_model=UserRead)
 async def register_user(user: UserCreate, session: AsyncSession = Depends(get_async_session)): 
-    hashed_password = hash_password(user.password)
-    updated_object = User(**user.model_dump(exclude={'password'}), password=hashed_password) 
+    hashed_password = await hash_password_async(user.password)
+    updated_object = User(**user.model_dump(exclude={'password', 'password_confirm'}), password=hashed_password) 
     try: 
         session.add(updated_object)
         await session.commit()
@@ -27,31 +29,51 @@ async def register_user(user: UserCreate, session: AsyncSession = Depends(get_as
         raise HTTPException(status_code=status.HTTP_409_CONFLICT)  
     return updated_object
 
-@router.post('/token', response_model=UserRead)
-async def signin(credential: OAuth2PasswordRequestForm = Depends(OAuth2PasswordRequestForm), session: AsyncSession = Depends(get_async_session)): 
+@router.post('/token', response_model=Token)
+async def signin(credential: OAuth2PasswordRequestForm = Depends(OAuth2PasswordRequestForm), read_session: AsyncSession = Depends(get_read_session), session: AsyncSession = Depends(get_async_session)): 
     email = credential.username; password = credential.password
-    user = await authenticate(Credential(email=email, password=password), session) 
+    user = await authenticate(Credential(email=email, password=password), read_session) 
     if not user: 
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid signin credentials")
-    token = await create_access_token(user, session) 
-    return {"access_token": token.token, "token_type": "bearer"}
+    raw_token, _ = await create_access_token(user, session) 
+    return {"access_token": raw_token, "token_type": "bearer"}
 
 @router.post('/login')
-async def login(response: Response, email: str = Form(...), password: str = Form(...), session: AsyncSession = Depends(get_async_session)): 
-    user = await authenticate(Credential(email=email, password=password), session=session) 
+async def login(request: Request, response: Response, email: str = Form(...), password: str = Form(...), read_session: AsyncSession = Depends(get_read_session), session: AsyncSession = Depends(get_async_session)): 
+    user = await authenticate(Credential(email=email, password=password), session=read_session) 
     if not user: 
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    token = await create_access_token(user=user, session=session)
+    raw_token, token = await create_access_token(user=user, session=session)
     response.set_cookie(
         TOKEN_COOKIE_NAME,
-        token.token, 
+        raw_token, 
         max_age=token.max_age(),
         samesite='lax',
         secure=True, 
         httponly=True
     )    
+    await materialize_cookie_cart(request, response, user)
 
-@router.get('/me', response_model=User)
+@router.get('/me', response_model=UserRead)
 async def get_authenticated_user(user: User = Depends(get_curr_user)): 
     return user
 
+
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(response: Response, token: str = Depends(APIKeyCookie(name=TOKEN_COOKIE_NAME)), session: AsyncSession = Depends(get_async_session)): 
+    access_token = (await session.scalars(select(AccessToken).where(AccessToken.token_hash == hash_token(token)))).one_or_none() 
+    if access_token: 
+        await session.delete(access_token)
+        await session.commit() 
+        token_cache.revoke(access_token.token_hash)
+    response.delete_cookie(TOKEN_COOKIE_NAME)
+
+@router.patch('/{id}/role', response_model=UserRead, dependencies=[Depends(Rbac(role=[Role.ADMIN, Role.DEVELOPER]).accessible_to)])
+async def change_user_role(id: UUID, role: Role = Body(..., embed=True), session: AsyncSession = Depends(get_async_session)): 
+    res = await session.execute(update(User).where(User.id == id).values(role=role))
+    if res.rowcount == 0: 
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
+    await session.commit() 
+    # cached sessions of this user would keep the old role until their ttl runs out
+    token_cache.invalidate_user(id)
+    return await session.get(User, id)
@@ -1,27 +1,31 @@
 from fastapi import  HTTPException, status
-from .password import verify_password
+from .password import verify_password_async
 from ..db.db_conn import AsyncSession
 from ..db.schema import Credential
-from ..db.model import User, AccessToken
+from ..db.model import User, AccessToken, generate_token, hash_token
 from sqlalchemy import select
 
 
 async def authenticate(user: Credential, session: AsyncSession ) -> User | None : 
+    # pass a read session, the hash check is slow and must not sit on the single write connection
     q = select(User).where(User.email == user.email)
     db_user = (await session.scalars(q)).one_or_none() 
     
     if not db_user: 
         return None
 
-    is_valid_passsword = verify_password(user.password, db_user.password) 
+    is_valid_passsword = await verify_password_async(user.password, db_user.password) 
     
     if not is_valid_passsword: 
         return None    
 
     return db_user 
 
-async def create_access_token(user: User, session: AsyncSession): 
-    token = AccessToken(user=user)
+async def create_access_token(user: User, session: AsyncSession) -> tuple[str, AccessToken]: 
+    # only the hash is stored, the raw token exists just long enough to hand to the client
+    # user usually comes from a read session, so link it by id rather than attaching the instance
+    raw_token = generate_token()
+    token = AccessToken(user_id=user.id, token_hash=hash_token(raw_token))
     session.add(token) 
     await session.commit() 
-    return token 
+    return raw_token, token 
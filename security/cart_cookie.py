@@ -0,0 +1,48 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import zlib
+from ..cart_store import CartLine
+
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SECRET = os.environ.get('ICEEDGE_CART_COOKIE_SECRET', '').encode()
+CART_COOKIE_MIN_SECRET_SIZE = 32
+CART_COOKIE_MAX_AGE = 7 * 24 * 3600
+CART_COOKIE_MAX_ITEMS = 50
+SIGNATURE_SIZE = 16
+MAX_PAYLOAD_SIZE = 16 * 1024
+
+
+def check_cart_cookie_secret() -> None: 
+    # called at startup, a missing or short key would let clients forge cart prices
+    if len(CART_COOKIE_SECRET) < CART_COOKIE_MIN_SECRET_SIZE: 
+        raise RuntimeError(f'ICEEDGE_CART_COOKIE_SECRET must be set to at least {CART_COOKIE_MIN_SECRET_SIZE} bytes')
+
+
+def sign(payload: bytes) -> bytes: 
+    return hmac.new(CART_COOKIE_SECRET, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def encode_cart(lines: dict[int, CartLine]) -> str: 
+    data = [int(time.time()), [[product_id, line.quantity, line.unit_price] for product_id, line in sorted(lines.items())]]
+    payload = zlib.compress(json.dumps(data, separators=(',', ':')).encode(), 9)
+    return base64.urlsafe_b64encode(sign(payload) + payload).decode().rstrip('=')
+
+
+def decode_cart(value: str | None) -> dict[int, CartLine]: 
+    if not value: 
+        return {}
+    try: 
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        signature, payload = raw[:SIGNATURE_SIZE], raw[SIGNATURE_SIZE:]
+        if not hmac.compare_digest(signature, sign(payload)): 
+            return {}
+        issued_at, items = json.loads(zlib.decompressobj().decompress(payload, MAX_PAYLOAD_SIZE))
+        if issued_at + CART_COOKIE_MAX_AGE < time.time(): 
+            return {}
+        return {int(product_id): CartLine(int(quantity), float(unit_price)) for product_id, quantity, unit_price in items[:CART_COOKIE_MAX_ITEMS]}
+    except (ValueError, TypeError, zlib.error): 
+        return {}
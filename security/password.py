@@ -1,10 +1,58 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=['argon2'], deprecated='auto') 
+pwd_context = CryptContext(schemes=['argon2'], deprecated='auto')
 
-def hash_password(password: str) -> str: 
+PASSWORD_POOL_KIND = os.environ.get('ICEEDGE_PASSWORD_POOL', 'thread')
+PASSWORD_POOL_WORKERS = int(os.environ.get('ICEEDGE_PASSWORD_POOL_WORKERS', os.cpu_count() or 1))
+PASSWORD_POOL_MAX_PENDING = int(os.environ.get('ICEEDGE_PASSWORD_POOL_MAX_PENDING', 64))
+
+_executor: Executor | None = None
+_pending = 0
+
+def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
-def verify_password(password: str, hashed_password: str) -> bool: 
-    return pwd_context.verify(password, hashed_password) 
+def verify_password(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+def configure_password_pool(kind: str = PASSWORD_POOL_KIND, workers: int = PASSWORD_POOL_WORKERS, max_pending: int = PASSWORD_POOL_MAX_PENDING) -> None:
+    global PASSWORD_POOL_KIND, PASSWORD_POOL_WORKERS, PASSWORD_POOL_MAX_PENDING
+    if kind not in ('thread', 'process'):
+        raise ValueError("Password pool kind must be 'thread' or 'process'")
+    shutdown_password_pool()
+    PASSWORD_POOL_KIND, PASSWORD_POOL_WORKERS, PASSWORD_POOL_MAX_PENDING = kind, workers, max_pending
+
+def get_password_pool() -> Executor:
+    global _executor
+    if _executor is None:
+        if PASSWORD_POOL_KIND == 'process':
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, thread_name_prefix='argon2')
+    return _executor
+
+def shutdown_password_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+async def _run_in_pool(fn, *args):
+    global _pending
+    if _pending >= PASSWORD_POOL_MAX_PENDING:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Too many sign-in attempts in progress, retry shortly', headers={'Retry-After': '1'})
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_password_pool(), fn, *args)
+    finally:
+        _pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(hash_password, password)
 
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _run_in_pool(verify_password, password, hashed_password)
@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import NamedTuple
+from uuid import UUID
+from ..db.model import User
+from ..db.schema import Role
+
+TOKEN_CACHE_MAX_SIZE = 10_000
+TOKEN_CACHE_TTL_SECONDS = 300
+
+
+def seconds_until(expiration_date: datetime) -> float:
+    if expiration_date.tzinfo is None:
+        expiration_date = expiration_date.replace(tzinfo=timezone.utc)
+    return (expiration_date - datetime.now(tz=timezone.utc)).total_seconds()
+
+
+class CachedUser(NamedTuple):
+    # a plain copy of the columns requests read, ORM instances go stale once their session closes
+    id: UUID
+    role: Role
+    email: str
+    firstname: str
+    lastname: str
+    address: str | None
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> 'CachedUser':
+        return cls(user.id, user.role, user.email, user.firstname, user.lastname, user.address, user.created_at)
+
+
+class TokenCache:
+    def __init__(self, max_size: int = TOKEN_CACHE_MAX_SIZE, ttl: float = TOKEN_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[CachedUser, float]] = OrderedDict()
+
+    # keyed by token hash, like the table, so raw tokens are never held in memory
+    def get(self, token: str) -> CachedUser | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: CachedUser, expiration_date: datetime) -> None:
+        ttl = min(self.ttl, seconds_until(expiration_date))
+        if ttl <= 0:
+            return
+        self._entries[token] = (user, time.monotonic() + ttl)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    # callers evict after their commit, whichever way they wrote to the token or user tables
+    def revoke(self, *tokens: str) -> None:
+        for token in tokens:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id: UUID) -> None:
+        for token in [token for token, (user, _) in self._entries.items() if user.id == user_id]:
+            del self._entries[token]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+token_cache = TokenCache()
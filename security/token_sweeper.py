@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from ..db.db_conn import async_session_maker
+from ..db.model import AccessToken, Job
+from ..jobs import job, enqueue
+from .token_cache import token_cache
+
+TOKEN_SWEEP_INTERVAL = 15 * 60.0
+TOKEN_SWEEP_BATCH_SIZE = 500
+TOKEN_SWEEP_JOB = 'sweep_expired_tokens'
+
+logger = logging.getLogger(__name__)
+
+
+class TokenSweeper:
+    def __init__(self, interval: float = TOKEN_SWEEP_INTERVAL, batch_size: int = TOKEN_SWEEP_BATCH_SIZE, session_maker: async_sessionmaker = async_session_maker):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.session_maker = session_maker
+        self.deleted = 0
+        self._task: asyncio.Task | None = None
+
+    async def sweep_batch(self) -> int:
+        now = datetime.now(tz=timezone.utc)
+        # one short transaction per batch, so logins never wait long behind the sweep
+        async with self.session_maker() as session:
+            expired = select(AccessToken.id).where(AccessToken.expiration_date <= now).limit(self.batch_size)
+            q = delete(AccessToken).where(AccessToken.id.in_(expired.scalar_subquery())).returning(AccessToken.token_hash)
+            token_hashes = (await session.execute(q)).scalars().all()
+            if len(token_hashes) >= self.batch_size:
+                # more are left, the next batch is queued in the same transaction as this one
+                enqueue(session, TOKEN_SWEEP_JOB, {})
+            await session.commit()
+        token_cache.revoke(*token_hashes)
+        self.deleted += len(token_hashes)
+        return len(token_hashes)
+
+    async def schedule(self) -> bool:
+        async with self.session_maker() as session:
+            pending = await session.scalar(select(Job.id).where(Job.name == TOKEN_SWEEP_JOB, Job.failed == False).limit(1))
+            if pending is not None:
+                return False
+            enqueue(session, TOKEN_SWEEP_JOB, {})
+            await session.commit()
+        return True
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.schedule()
+            except Exception:
+                logger.exception('Failed to schedule the expired access token sweep')
+            await asyncio.sleep(self.interval)
+
+
+token_sweeper = TokenSweeper()
+
+
+@job(TOKEN_SWEEP_JOB)
+async def sweep_expired_tokens(payload: dict) -> None:
+    await token_sweeper.sweep_batch()
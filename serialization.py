@@ -0,0 +1,24 @@
+from typing import Any, Iterable
+from fastapi import Response, status
+from pydantic_core import to_json
+from sqlalchemy.engine import RowMapping
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, pydantic-core ships with pydantic
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return to_json(obj)
+
+
+def rows_as_dicts(rows: Iterable[RowMapping]) -> list[dict]:
+    return [dict(row) for row in rows]
+
+
+def json_response(obj: Any, status_code: int = status.HTTP_200_OK) -> Response:
+    # rows come straight from the database, so skip response_model validation
+    return Response(content=dumps(obj), status_code=status_code, media_type='application/json')
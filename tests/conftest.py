@@ -1,11 +1,16 @@
+import os
+os.environ.setdefault('ICEEDGE_CART_COOKIE_SECRET', 'test_cart_cookie_secret_that_is_long_enough')
 from fastapi import status, Depends
-from fastapi.testclient import TestClient
+import httpx
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 import pytest_asyncio
 from ..main import app
-from ..db.db_conn import get_async_session
+from ..db.db_conn import get_async_session, get_read_session
 from ..db.model import Base, User
 from ..db.schema import Role
+from ..db.categories import load_category_map
+from ..db.search import create_product_search
+from sqlalchemy import text
 import pytest
 from uuid import UUID, uuid4
 
@@ -26,14 +31,17 @@ async def get_fake_user_by_role(role: Role = Role.CUSTOMER):
     return get_fake_user
 
 class TestUser(): 
-    def __init__(self, role: Role = Role.CUSTOMER, id: UUID = uuid4(), email: str = 'lisanalgaib@gmail.com'): 
+    def __init__(self, role: Role = Role.CUSTOMER, id: UUID | None = None, email: str | None = None): 
        self.role = role 
-       self.id = id 
-       self.email = email
+       self.id = id or uuid4() 
+       self.email = email or f'{self.id.hex}@iceedge.io'
        
     async def get_fake_user(self, session: AsyncSession = Depends(get_test_session)): 
-        user = User( id=self.id, firstname="Muhammad", lastname='lastname', role=self.role, email=self.email, password='password1234')
-        session.add(user) 
+        user = await session.get(User, self.id)
+        if user is None: 
+            user = User( id=self.id, firstname="Muhammad", lastname='lastname', role=self.role, email=self.email, password='password1234')
+            session.add(user) 
+        user.role = self.role
         await session.commit() 
         return user 
     
@@ -42,12 +50,18 @@ class TestUser():
 async def prepare_db(): 
     async with test_engine.begin() as conn: 
         await conn.run_sync(Base.metadata.create_all) 
+        await create_product_search(conn)
+    async with async_session() as session: 
+        await load_category_map(session)
     yield
     async with test_engine.begin() as conn: 
+        await conn.execute(text('DROP TABLE IF EXISTS products_fts'))
         await conn.run_sync(Base.metadata.drop_all) 
 
 @pytest_asyncio.fixture(scope='module')
 async def test_client():
     app.dependency_overrides[get_async_session] = get_test_session
-    async with TestClient(app=app) as c: 
-        yield c 
\ No newline at end of file
+    app.dependency_overrides[get_read_session] = get_test_session
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://localhost') as c: 
+        yield c
+    app.dependency_overrides.clear() 
\ No newline at end of file
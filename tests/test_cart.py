@@ -0,0 +1,201 @@
+import base64
+import json
+import time
+import zlib
+import pytest
+from uuid import uuid4
+from fastapi import HTTPException, status
+from sqlalchemy import select, func
+from .conftest import async_session
+from ..cart_store import MemoryCartStore, CartLine
+from ..db.model import Cart, CartItem, User, Role, Product, Order, OrderItem
+from ..db.schema import Cat
+from ..db.categories import category_id
+from ..routers.cart import checkout_cart, SHIPPING_FEE
+from ..security import cart_cookie
+from ..security.cart_cookie import encode_cart, decode_cart, CART_COOKIE_MAX_AGE, CART_COOKIE_MAX_ITEMS
+
+
+async def create_user() -> User:
+    async with async_session() as session:
+        user = User(id=uuid4(), firstname='Muhammad', lastname='lastname', role=Role.CUSTOMER, email=f'{uuid4().hex}@iceedge.io', password='password1234')
+        session.add(user)
+        await session.commit()
+    return user
+
+async def stored_lines(user_id) -> dict[int, int]:
+    async with async_session() as session:
+        rows = (await session.execute(select(CartItem.product_id, CartItem.quantity).join(Cart, CartItem.cart_id == Cart.id).where(Cart.user_id == user_id))).all()
+    return {row.product_id: row.quantity for row in rows}
+
+def memory_store(**kwargs) -> MemoryCartStore:
+    return MemoryCartStore(session_maker=async_session, read_session_maker=async_session, **kwargs)
+
+
+@pytest.mark.asyncio
+class TestMemoryCartStore:
+    async def test_writes_stay_in_memory_until_flush(self):
+        store = memory_store()
+        user = await create_user()
+        await store.set_item(user.id, 1, 2, 100.0)
+        await store.set_item(user.id, 2, 1, 50.0)
+        assert store._carts[user.id].dirty
+        assert (await store.get(user.id))['total'] == 250.0
+        assert await stored_lines(user.id) == {}
+
+        cart_id = await store.flush(user.id)
+        assert cart_id is not None
+        assert not store._carts[user.id].dirty
+        assert await stored_lines(user.id) == {1: 2, 2: 1}
+        async with async_session() as session:
+            assert await session.scalar(select(Cart.total).where(Cart.id == cart_id)) == 250.0
+
+    async def test_flush_writes_only_changes(self):
+        store = memory_store()
+        user = await create_user()
+        await store.set_item(user.id, 1, 2, 100.0)
+        cart_id = await store.flush(user.id)
+        version = store._carts[user.id].flushed_version
+        assert await store.flush(user.id) == cart_id
+        assert store._carts[user.id].flushed_version == version
+
+        assert await store.remove_item(user.id, 1)
+        assert not await store.remove_item(user.id, 1)
+        assert store._carts[user.id].dirty
+        await store.flush_all()
+        assert await stored_lines(user.id) == {}
+        assert not store._carts[user.id].dirty
+
+    async def test_evicts_idle_carts_once_flushed(self):
+        store = memory_store(idle_seconds=0)
+        user = await create_user()
+        await store.set_items(user.id, {1: CartLine(3, 10.0)})
+        store.evict_idle()
+        assert user.id in store._carts
+
+        await store.flush(user.id)
+        store.evict_idle()
+        assert user.id not in store._carts
+        # a later request reloads the cart from the database
+        assert (await store.get(user.id))['items'] == [{'product_id': 1, 'quantity': 3, 'unit_price': 10.0}]
+
+    async def test_recently_used_carts_stay(self):
+        store = memory_store(idle_seconds=60)
+        user = await create_user()
+        await store.set_item(user.id, 1, 1, 10.0)
+        await store.flush(user.id)
+        store.evict_idle()
+        assert user.id in store._carts
+
+    async def test_stop_flushes_dirty_carts(self):
+        store = memory_store(flush_interval=60)
+        user = await create_user()
+        store.start()
+        await store.set_item(user.id, 4, 2, 10.0)
+        await store.stop()
+        assert await stored_lines(user.id) == {4: 2}
+
+
+async def create_cart(user: User, lines: list[tuple[float, int, int]]) -> tuple[int, list[int]]:
+    # lines are (unit price, quantity in cart, stock left)
+    async with async_session() as session:
+        products = [Product(name=f'Checkout hoodie {uuid4().hex[:8]}', price=price, discount=0, description='Checkout', cat_id=category_id(Cat.SHIRT), thumbnail='t.png', gallery=[], amt_left=stock) for price, _, stock in lines]
+        session.add_all(products)
+        cart = Cart(user_id=user.id, total=sum(price * quantity for price, quantity, _ in lines))
+        session.add(cart)
+        await session.flush()
+        session.add_all(CartItem(cart_id=cart.id, product_id=product.id, unit_price=price, quantity=quantity) for product, (price, quantity, _) in zip(products, lines))
+        await session.commit()
+        return cart.id, [product.id for product in products]
+
+async def stock_left(product_ids: list[int]) -> list[int]:
+    async with async_session() as session:
+        return [await session.scalar(select(Product.amt_left).where(Product.id == id)) for id in product_ids]
+
+
+@pytest.mark.asyncio
+class TestCheckout:
+    async def test_checkout(self):
+        user = await create_user()
+        cart_id, product_ids = await create_cart(user, [(5000.0, 2, 10), (3000.0, 1, 1)])
+        async with async_session() as session:
+            result = await checkout_cart(session, cart_id, user, 'G50, Balogun Gambari')
+        assert result.total == 5000.0 * 2 + 3000.0 + SHIPPING_FEE
+        assert len(result.order_item_ids) == 2
+        assert await stock_left(product_ids) == [8, 0]
+        async with async_session() as session:
+            order = await session.get(Order, result.order_id)
+            assert order.customer_id == user.id and order.quantity == 3 and order.shipping_address == 'G50, Balogun Gambari'
+            items = (await session.execute(select(OrderItem.product_id, OrderItem.quantity).where(OrderItem.order_id == result.order_id))).all()
+            assert sorted(items) == sorted(zip(product_ids, [2, 1]))
+            assert await session.get(Cart, cart_id) is None
+            assert await session.scalar(select(func.count()).select_from(CartItem).where(CartItem.cart_id == cart_id)) == 0
+
+    async def test_insufficient_stock(self):
+        user = await create_user()
+        cart_id, product_ids = await create_cart(user, [(5000.0, 2, 10), (3000.0, 2, 1)])
+        async with async_session() as session:
+            with pytest.raises(HTTPException) as e:
+                await checkout_cart(session, cart_id, user, None)
+        assert e.value.status_code == status.HTTP_409_CONFLICT
+        # the product with enough stock is not decremented either
+        assert await stock_left(product_ids) == [10, 1]
+        async with async_session() as session:
+            assert await session.scalar(select(func.count()).select_from(Order).where(Order.customer_id == user.id)) == 0
+            assert await session.get(Cart, cart_id) is not None
+            assert await session.scalar(select(func.count()).select_from(CartItem).where(CartItem.cart_id == cart_id)) == 2
+
+    async def test_empty_cart(self):
+        user = await create_user()
+        cart_id, _ = await create_cart(user, [])
+        async with async_session() as session:
+            with pytest.raises(HTTPException) as e:
+                await checkout_cart(session, cart_id, user, None)
+        assert e.value.status_code == status.HTTP_400_BAD_REQUEST
+        async with async_session() as session:
+            assert await session.scalar(select(func.count()).select_from(Order).where(Order.customer_id == user.id)) == 0
+
+
+def signed_cookie(data) -> str:
+    payload = zlib.compress(json.dumps(data).encode(), 9)
+    return base64.urlsafe_b64encode(cart_cookie.sign(payload) + payload).decode().rstrip('=')
+
+
+class TestCartCookie:
+    lines = {1: CartLine(2, 4999.0), 7: CartLine(1, 15000.0)}
+
+    def test_round_trip(self):
+        assert decode_cart(encode_cart(self.lines)) == self.lines
+
+    def test_tampered(self):
+        raw = bytearray(base64.urlsafe_b64decode(encode_cart(self.lines) + '=='))
+        raw[-1] ^= 1
+        assert decode_cart(base64.urlsafe_b64encode(bytes(raw)).decode()) == {}
+        # so is an intact payload under an altered signature
+        forged = signed_cookie([int(time.time()), [[1, 2, 1.0]]])
+        assert decode_cart(forged[:2] + ('A' if forged[2] != 'A' else 'B') + forged[3:]) == {}
+
+    def test_truncated(self):
+        value = encode_cart(self.lines)
+        for size in (0, 5, cart_cookie.SIGNATURE_SIZE, len(value) // 2, len(value) - 1):
+            assert decode_cart(value[:size]) == {}
+
+    def test_oversize(self):
+        # a zip bomb with a valid signature stops at MAX_PAYLOAD_SIZE instead of inflating in memory
+        bomb = signed_cookie([int(time.time()), [[1, 1, 1.0]] * 100_000])
+        assert len(bomb) < 4096
+        assert decode_cart(bomb) == {}
+        many = signed_cookie([int(time.time()), [[i, 1, 1.0] for i in range(CART_COOKIE_MAX_ITEMS + 10)]])
+        assert len(decode_cart(many)) == CART_COOKIE_MAX_ITEMS
+
+    def test_expired(self):
+        assert decode_cart(signed_cookie([int(time.time()) - CART_COOKIE_MAX_AGE - 1, [[1, 1, 1.0]]])) == {}
+
+    def test_missing_secret_fails_startup(self, monkeypatch: pytest.MonkeyPatch):
+        cart_cookie.check_cart_cookie_secret()
+        monkeypatch.setattr(cart_cookie, 'CART_COOKIE_SECRET', b'')
+        with pytest.raises(RuntimeError):
+            cart_cookie.check_cart_cookie_secret()
+        monkeypatch.setattr(cart_cookie, 'CART_COOKIE_SECRET', b'short')
+        with pytest.raises(RuntimeError):
+            cart_cookie.check_cart_cookie_secret()
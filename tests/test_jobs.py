@@ -0,0 +1,162 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from sqlalchemy import select, delete
+from .conftest import async_session
+from .. import jobs
+from ..jobs import JobQueue, job, enqueue
+from ..db.model import Job, User, AccessToken, Role
+from ..security.token_sweeper import TokenSweeper, TOKEN_SWEEP_JOB
+from ..security.token_cache import token_cache, CachedUser
+
+calls: list[dict] = []
+failures_left: dict[str, int] = {}
+
+@job('test_record')
+async def record(payload: dict):
+    calls.append(payload)
+    if failures_left.get(payload['key'], 0) > 0:
+        failures_left[payload['key']] -= 1
+        raise RuntimeError('Temporary failure')
+
+
+async def wait_for(predicate, timeout: float = 2.0):
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+async def get_job(job_id: int) -> Job | None:
+    async with async_session() as session:
+        return await session.get(Job, job_id)
+
+def test_enqueue_unknown_job():
+    with pytest.raises(ValueError):
+        enqueue(async_session(), 'no_such_job', {})
+
+
+@pytest.mark.asyncio
+class TestJobQueue:
+    async def test_runs_after_commit(self, monkeypatch: pytest.MonkeyPatch):
+        queue = JobQueue(workers=1, session_maker=async_session, read_session_maker=async_session)
+        monkeypatch.setattr(jobs, 'job_queue', queue)
+        queue.start()
+        try:
+            key = uuid4().hex
+            async with async_session() as session:
+                pending = enqueue(session, 'test_record', {'key': key})
+                await asyncio.sleep(0.05)
+                assert {'key': key} not in calls
+                await session.commit()
+            await wait_for(lambda: {'key': key} in calls)
+            await wait_for(lambda: not queue._queued)
+            assert await get_job(pending.id) is None
+        finally:
+            await queue.stop()
+
+    async def test_rolled_back_job_never_runs(self, monkeypatch: pytest.MonkeyPatch):
+        queue = JobQueue(workers=1, session_maker=async_session, read_session_maker=async_session)
+        monkeypatch.setattr(jobs, 'job_queue', queue)
+        async with async_session() as session:
+            enqueue(session, 'test_record', {'key': uuid4().hex})
+            await session.flush()
+            await session.rollback()
+        assert queue._queue.empty()
+
+    async def test_retry_with_backoff(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(jobs, 'JOB_BACKOFF_SECONDS', 0.05)
+        queue = JobQueue(workers=1, session_maker=async_session, read_session_maker=async_session)
+        key = uuid4().hex
+        failures_left[key] = 2
+        async with async_session() as session:
+            pending = enqueue(session, 'test_record', {'key': key})
+            await session.commit()
+
+        await queue._run(pending.id)
+        first = await get_job(pending.id)
+        assert first.attempts == 1 and not first.failed and 'Temporary failure' in first.last_error
+        assert first.run_after > datetime.now()
+
+        # not due yet, so an early wake up leaves the job alone
+        await queue._run(pending.id)
+        assert (await get_job(pending.id)).attempts == 1
+
+        await asyncio.sleep(0.06)
+        await queue._run(pending.id)
+        second = await get_job(pending.id)
+        assert second.attempts == 2
+        assert second.run_after - datetime.now() > timedelta(seconds=0.05)
+
+        await asyncio.sleep(0.11)
+        await queue._run(pending.id)
+        assert await get_job(pending.id) is None
+        assert calls.count({'key': key}) == 3
+
+    async def test_gives_up_after_max_attempts(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(jobs, 'JOB_BACKOFF_SECONDS', 0)
+        monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+        queue = JobQueue(workers=1, session_maker=async_session, read_session_maker=async_session)
+        key = uuid4().hex
+        failures_left[key] = 10
+        async with async_session() as session:
+            pending = enqueue(session, 'test_record', {'key': key})
+            await session.commit()
+        await queue._run(pending.id)
+        await queue._run(pending.id)
+        await queue._run(pending.id)
+        failed = await get_job(pending.id)
+        assert failed.failed and failed.attempts == 2
+        assert calls.count({'key': key}) == 2
+
+    async def test_outbox_recovered_after_crash(self, monkeypatch: pytest.MonkeyPatch):
+        # the process dies after the commit but before any worker picked the job up
+        crashed = JobQueue(workers=1, session_maker=async_session, read_session_maker=async_session)
+        monkeypatch.setattr(jobs, 'job_queue', crashed)
+        key = uuid4().hex
+        async with async_session() as session:
+            pending = enqueue(session, 'test_record', {'key': key})
+            await session.commit()
+        assert {'key': key} not in calls
+
+        restarted = JobQueue(workers=1, session_maker=async_session, read_session_maker=async_session)
+        monkeypatch.setattr(jobs, 'job_queue', restarted)
+        restarted.start()
+        try:
+            await wait_for(lambda: {'key': key} in calls)
+            await wait_for(lambda: not restarted._queued)
+        finally:
+            await restarted.stop()
+        assert await get_job(pending.id) is None
+
+
+@pytest.mark.asyncio
+class TestTokenSweeper:
+    async def test_sweep_chains_batches_through_the_outbox(self, monkeypatch: pytest.MonkeyPatch):
+        queue = JobQueue(workers=1, session_maker=async_session, read_session_maker=async_session)
+        monkeypatch.setattr(jobs, 'job_queue', queue)
+        sweeper = TokenSweeper(batch_size=2, session_maker=async_session)
+        expired = datetime.now(tz=timezone.utc) - timedelta(days=1)
+        async with async_session() as session:
+            user = User(id=uuid4(), firstname='Muhammad', lastname='lastname', role=Role.CUSTOMER, email=f'{uuid4().hex}@iceedge.io', password='password1234')
+            session.add(user)
+            expired_hashes = [uuid4().hex for _ in range(3)]
+            session.add_all(AccessToken(user_id=user.id, token_hash=token_hash, expiration_date=expired) for token_hash in expired_hashes)
+            session.add(AccessToken(user_id=user.id, token_hash=uuid4().hex))
+            await session.commit()
+        # a cache entry that outlived its row, the sweep has to drop it explicitly
+        token_cache.put(expired_hashes[0], CachedUser.from_user(user), datetime.now(tz=timezone.utc) + timedelta(minutes=1))
+
+        assert await sweeper.schedule()
+        assert not await sweeper.schedule()
+        assert await sweeper.sweep_batch() == 2
+        assert await sweeper.sweep_batch() == 1
+        assert sweeper.deleted == 3
+        assert token_cache.get(expired_hashes[0]) is None
+        async with async_session() as session:
+            left = (await session.scalars(select(AccessToken).where(AccessToken.user_id == user.id))).all()
+            queued = (await session.scalars(select(Job.name).where(Job.name == TOKEN_SWEEP_JOB))).all()
+            await session.execute(delete(Job).where(Job.name == TOKEN_SWEEP_JOB))
+            await session.commit()
+        assert len(left) == 1
+        # the scheduled job plus the follow up queued by the full first batch
+        assert len(queued) == 2
@@ -1,14 +1,21 @@
+import asyncio
+import json
 import pytest
 import pytest_asyncio
 import httpx
 from fastapi import status, HTTPException
-from .conftest import TestUser, Role
+from .conftest import TestUser, Role, async_session
 from ..main import app
 from ..db.db_conn import get_async_session
-from ..db.model import Order, OrderItem
+from ..db.model import Base, Order, OrderItem
+from ..db.engine import make_engine
+from ..db.categories import load_category_map, category_id
+from ..routers.order import reserve_stock
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from ..db.schema import UserCreate, UserUpdate, OrderCreate, OrderRead
 from ..routers.product import get_curr_user, Product, Cat
-from uuid import uuid4
+from uuid import UUID, uuid4
 from .test_reviews import create_new_prod
 
 class TestGetOrders: 
@@ -31,6 +38,7 @@ class TestGetOrders:
         
 @pytest_asyncio.fixture(scope='module', autouse=True)
 async def create_test_product(test_client: httpx.AsyncClient): 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
     return (await create_new_prod(test_client))
 
 customer_id=uuid4()    
@@ -43,6 +51,51 @@ async def create_test_order(product: Product ,test_client: httpx.AsyncClient) ->
     await test_client.post('/order', json=order)
     return order
 
+@pytest_asyncio.fixture
+async def export_url() -> str: 
+    return '/order/export'
+
+@pytest_asyncio.fixture
+async def exported_order(test_client: httpx.AsyncClient, create_test_product) -> dict: 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
+    payload = {
+        'total': 21498, 'shipping_fee': 1500, 'shipping_address': 'G50', 'order_status': 'cancelled', 
+        'order_items': [{'total': 19998, 'quantity': 2, 'product_id': create_test_product['id'], 'unit_price': 9999}], 
+    }
+    result = await test_client.post('/order/', json=payload)
+    assert result.status_code == status.HTTP_201_CREATED
+    return result.json()
+
+@pytest.mark.asyncio
+class TestExportOrders: 
+    async def test_unauthenticated(self, test_client: httpx.AsyncClient, export_url: str): 
+        app.dependency_overrides.pop(get_curr_user, None)
+        result = await test_client.get(export_url) 
+        assert result.status_code == status.HTTP_401_UNAUTHORIZED
+    
+    async def test_verboten(self, test_client: httpx.AsyncClient, export_url: str): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
+        result = await test_client.get(export_url) 
+        assert result.status_code == status.HTTP_403_FORBIDDEN
+    
+    async def test_csv(self, test_client: httpx.AsyncClient, export_url: str, exported_order: dict): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        result = await test_client.get(export_url, params={'format': 'csv', 'status': 'cancelled'}) 
+        assert result.status_code == status.HTTP_200_OK
+        assert result.headers['content-type'].startswith('text/csv')
+        lines = result.text.splitlines()
+        assert lines[0].startswith('order_id,customer_id')
+        row = next(line.split(',') for line in lines[1:] if line.startswith(str(UUID(exported_order['id']))))
+        assert row[2] == 'cancelled' and row[-3:] == [str(exported_order['order_items'][0]['product_id']), '2', '9999.0']
+    
+    async def test_ndjson_filters_by_status(self, test_client: httpx.AsyncClient, export_url: str, exported_order: dict): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        result = await test_client.get(export_url, params={'status': 'delivered'}) 
+        assert result.status_code == status.HTTP_200_OK
+        orders = [json.loads(line) for line in result.text.splitlines()]
+        assert all(order['status'] == 'delivered' for order in orders)
+        assert str(UUID(exported_order['id'])) not in {order['id'] for order in orders}
+
 class TestGetOneOrder:
     def __init__(self):
         self.url = '/orders/'
@@ -79,4 +132,50 @@ class TestGetMyOrder:
         app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
         result = await test_client.get(self.url) 
         assert result.status_code == status.HTTP_200_OK
-        
\ No newline at end of file
+        
+
+HOT_PRODUCT_STOCK = 50
+HAMMER_COROUTINES = 300
+
+@pytest.mark.asyncio
+async def test_reserve_stock_never_oversells(tmp_path): 
+    engine = make_engine(f"sqlite+aiosqlite:///{tmp_path / 'stock.db'}", pool_size=20, max_overflow=0)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn: 
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_maker() as session: 
+        await load_category_map(session)
+        product = Product(name='Hot hoodie', price=9999, discount=0, description='Limited', cat_id=category_id(Cat.SHIRT), thumbnail='t.png', gallery=[], amt_left=HOT_PRODUCT_STOCK)
+        session.add(product) 
+        await session.commit() 
+
+    async def buy_one() -> bool: 
+        async with session_maker() as session: 
+            if await reserve_stock(session, {product.id: 1}) is not None: 
+                await session.rollback()
+                return False 
+            await session.commit()
+            return True
+
+    results = await asyncio.gather(*(buy_one() for _ in range(HAMMER_COROUTINES)))
+    async with session_maker() as session: 
+        amt_left = await session.scalar(select(Product.amt_left).where(Product.id == product.id))
+    await engine.dispose()
+    assert amt_left == 0 
+    assert sum(results) == HOT_PRODUCT_STOCK
+
+
+@pytest.mark.asyncio
+async def test_create_order_for_current_user(test_client: httpx.AsyncClient): 
+    buyer = TestUser(Role.DEVELOPER)
+    app.dependency_overrides[get_curr_user] = buyer.get_fake_user
+    product = await create_new_prod(test_client)
+    payload = {
+        'total': 21498, 'shipping_fee': 1500, 'shipping_address': 'G50', 'customer_id': str(uuid4()), 
+        'order_items': [{'total': 19998, 'quantity': 2, 'product_id': product['id'], 'unit_price': 9999}], 
+    }
+    res = await test_client.post('/order/', json=payload)
+    assert res.status_code == status.HTTP_201_CREATED
+    async with async_session() as session: 
+        customer_id = await session.scalar(select(Order.customer_id).where(Order.id == UUID(res.json()['id'])))
+    assert customer_id == buyer.id
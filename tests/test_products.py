@@ -1,15 +1,19 @@
+import json
 import pytest
 import pytest_asyncio
 import httpx
+from uuid import uuid4
 from fastapi import status, HTTPException
 from .conftest import TestUser, Role
 from ..main import app
 from ..routers.product import get_curr_user, Product, Cat
+from ..db import product_import
+from ..db.query_stats import QueryStats
 
 
-async def create_new_prod(test_client: httpx.AsyncClient, cat: Cat = Cat.SHIRT, name: str = 'Black Hoodie'): 
+async def create_new_prod(test_client: httpx.AsyncClient, cat: Cat = Cat.SHIRT, name: str | None = None): 
         new_prod = {
-            'name':name, 'price':9999, 'discount':5, 'thumbnail':'thumbnail.png', 'gallery':['gallery_img_1.png', 'gallery_img_2.png'], 'amt_left':10, 'cat':cat, 'description':'Beautiful Hoodie'
+            'name':name or f'Black Hoodie {uuid4().hex[:8]}', 'price':9999, 'discount':5, 'thumbnail':'thumbnail.png', 'gallery':['gallery_img_1.png', 'gallery_img_2.png'], 'amt_left':10, 'cat':cat, 'description':'Beautiful Hoodie'
         } 
         product = await test_client.post('/products/', json=new_prod) 
         assert product.status_code == status.HTTP_201_CREATED
@@ -30,7 +34,7 @@ class TestCreateProduct:
         app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
         new_prod = {"name":'Black Hoodie', "price":9999, "discount":5, "thumbnail":'thumbnail.png', "gallery":['gallery_img_1.png', 'gallery_img_2.png'], "amt_left":10, "cat":Cat.SHIRT, "description":'Beatiful  Hoodie' }
         res = await test_client.post('/products/', json=new_prod) 
-        assert res.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert res.status_code == status.HTTP_403_FORBIDDEN
     
     async def test_create_invalid_fields(self, test_client: httpx.AsyncClient): 
         app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
@@ -41,7 +45,8 @@ class TestCreateProduct:
     async def test_create_valid(self, test_client: httpx.AsyncClient): 
         app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
         data, new_prod = await create_new_prod(test_client)
-        assert data.name == new_prod['name']
+        assert data['name'] == new_prod['name']
+        assert data['cat'] == new_prod['cat']
  
 
 @pytest.mark.asyncio
@@ -50,21 +55,162 @@ async def test_get_all_products(test_client: httpx.AsyncClient):
     res = await test_client.get('/products')
     res.status_code == status.HTTP_200_OK    
 
+@pytest.mark.asyncio
+class TestPaginateProducts: 
+    async def test_invalid_cursor(self, test_client: httpx.AsyncClient): 
+        res = await test_client.get('/products/', params={'cursor': 'not-a-cursor'})
+        assert res.status_code == status.HTTP_400_BAD_REQUEST
+    
+    async def test_follow_cursor(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        for name in ['Page hoodie 1', 'Page hoodie 2', 'Page hoodie 3']: 
+            await create_new_prod(test_client, name=name)
+        first = (await test_client.get('/products/', params={'limit': 2})).json()
+        assert len(first['items']) == 2 
+        assert first['next_cursor'] 
+        second = (await test_client.get('/products/', params={'limit': 2, 'cursor': first['next_cursor']})).json()
+        seen = {p['id'] for p in first['items']} 
+        assert all(p['id'] not in seen for p in second['items'])
+
+@pytest.mark.asyncio
+class TestSparseFields: 
+    async def test_summary_by_default(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        await create_new_prod(test_client, name='Summary hoodie')
+        items = (await test_client.get('/products/')).json()['items']
+        assert set(items[0]) == {'id', 'name', 'price', 'discount', 'thumbnail', 'cat', 'avg_rating', 'ratings_count'}
+    
+    async def test_selected_fields(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        data, _ = await create_new_prod(test_client, name='Sparse hoodie')
+        res = await test_client.get(f"/products/{data['id']}", params={'fields': 'name,price,reviews'})
+        assert res.json() == {'id': data['id'], 'name': 'Sparse hoodie', 'price': 9999, 'reviews': []}
+    
+    async def test_unknown_field(self, test_client: httpx.AsyncClient): 
+        res = await test_client.get('/products/', params={'fields': 'name,password'})
+        assert res.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.asyncio
+class TestImportProducts: 
+    async def test_import_ndjson(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        rows = [
+            {'name': 'Imported hoodie', 'price': 9999, 'discount': 5, 'thumbnail': 'thumbnail.png', 'gallery': [], 'amt_left': 10, 'cat': Cat.SHIRT, 'description': 'Imported'},
+            {'name': 'Imported cap', 'price': 1, 'discount': 5, 'thumbnail': 'thumbnail.png', 'gallery': [], 'amt_left': 10, 'cat': Cat.CAP, 'description': 'Too cheap'},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows)
+        res = await test_client.post('/products/import', content=body, headers={'content-type': 'application/x-ndjson'})
+        assert res.status_code == status.HTTP_200_OK
+        report = res.json() 
+        assert report['inserted'] == 1 
+        assert [e['row'] for e in report['errors']] == [2]
+    
+    async def test_import_csv(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        body = 'name,price,discount,thumbnail,gallery,amt_left,cat,description\nCSV sock,4999,0,t.png,a.png|b.png,3,sock,Warm\n'
+        res = await test_client.post('/products/import', content=body, headers={'content-type': 'text/csv'})
+        assert res.json()['inserted'] == 1
+
+    async def test_import_csv_multiline_field(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        body = (
+            'name,price,discount,thumbnail,gallery,amt_left,cat,description\r\n'
+            'CSV scarf,4999,0,t.png,,3,mask,"Soft, warm\r\n\r\nand ""wide"""\r\n'
+            'CSV glove,4999,0,t.png,,3,sock,Single line\r\n'
+            'CSV beanie,4999,0,t.png,,3,cap,"Never closed\n'
+        )
+        res = await test_client.post('/products/import', content=body, headers={'content-type': 'text/csv'})
+        report = res.json()
+        assert report['inserted'] == 2
+        assert report['errors'] == [{'row': 6, 'errors': ['Quoted field is not closed']}]
+        masks = (await test_client.get('/products/mask', params={'fields': 'id,name', 'limit': 100})).json()['items']
+        scarf_id = next(item['id'] for item in masks if item['name'] == 'CSV scarf')
+        scarf = (await test_client.get(f'/products/{scarf_id}')).json()
+        assert scarf['description'] == 'Soft, warm\n\nand "wide"'
+
+    async def test_import_row_too_large(self, test_client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch): 
+        monkeypatch.setattr(product_import, 'IMPORT_MAX_ROW_BYTES', 64)
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        res = await test_client.post('/products/import', content='x' * 200, headers={'content-type': 'application/x-ndjson'})
+        assert res.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+@pytest.mark.asyncio
+class TestSearchProducts: 
+    async def test_search_no_words(self, test_client: httpx.AsyncClient): 
+        res = await test_client.get('/products/search', params={'q': '!!!'})
+        assert res.status_code == status.HTTP_400_BAD_REQUEST
+    
+    async def test_search_valid(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        await create_new_prod(test_client, name='Searchable corduroy jacket')
+        res = await test_client.get('/products/search', params={'q': 'cordur'})
+        assert res.status_code == status.HTTP_200_OK
+        assert [p['name'] for p in res.json()['items']] == ['Searchable corduroy jacket']
+
 @pytest.mark.asyncio   
 class TestGetProduct:
     async def test_get_product_invalid_format(self, test_client: httpx.AsyncClient): 
-        res = await test_client.get('/prorducts/shit_password')
+        res = await test_client.get('/products/shit_password')
         assert res.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
     
     async def test_get_product_invalid_id(self, test_client: httpx.AsyncClient): 
-        res = await test_client.get('/products/12')
+        res = await test_client.get('/products/999999')
         assert res.status_code == status.HTTP_404_NOT_FOUND
     
     async def test_get_product(self, test_client: httpx.AsyncClient): 
         app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
         data, _ = await create_new_prod(test_client)
-        res = await test_client.get(f'/products/{data.id}')
+        res = await test_client.get(f"/products/{data['id']}")
         assert res.status_code == status.HTTP_200_OK
+        assert res.json()['id'] == data['id']
+
+@pytest.mark.asyncio
+class TestProductCache: 
+    async def test_not_modified(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        data, _ = await create_new_prod(test_client, name='Cached hoodie')
+        first = await test_client.get(f"/products/{data['id']}")
+        assert first.headers['etag']
+        second = await test_client.get(f"/products/{data['id']}", headers={'If-None-Match': first.headers['etag']})
+        assert second.status_code == status.HTTP_304_NOT_MODIFIED
+    
+    async def test_update_invalidates(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+        data, _ = await create_new_prod(test_client, name='Repriced hoodie')
+        first = await test_client.get(f"/products/{data['id']}")
+        await test_client.patch(f"/products/{data['id']}", json={'price': 65000.99})
+        second = await test_client.get(f"/products/{data['id']}", headers={'If-None-Match': first.headers['etag']})
+        assert second.status_code == status.HTTP_200_OK
+        assert second.json()['price'] == 65000.99
+
+@pytest.mark.asyncio 
+async def test_metrics_by_route_template(test_client: httpx.AsyncClient): 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+    data, _ = await create_new_prod(test_client, name='Measured hoodie')
+    await test_client.get(f"/products/{data['id']}")
+    res = await test_client.get('/metrics')
+    assert res.status_code == status.HTTP_200_OK
+    assert 'http_request_duration_seconds_count{method="GET",route="/products/{id}"}' in res.text
+    assert f"/products/{data['id']}" not in res.text
+
+@pytest.mark.asyncio 
+async def test_server_timing(test_client: httpx.AsyncClient): 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+    data, _ = await create_new_prod(test_client, name='Timed hoodie')
+    res = await test_client.get(f"/products/{data['id']}")
+    assert res.headers['server-timing'].startswith('db;dur=')
+    # statements stay out of the header unless query stats debugging is on
+    assert 'select' not in res.headers['server-timing'].lower()
+
+def test_server_timing_debug(): 
+    stats = QueryStats()
+    for _ in range(3): 
+        stats.record('SELECT * FROM product WHERE id IN (?, ?, ?)', 0.002)
+    assert 'SELECT' not in stats.server_timing(threshold=2)
+    assert 'db-repeated-1;desc="3x"' in stats.server_timing(threshold=2)
+    debug = stats.server_timing(threshold=2, debug=True)
+    assert 'db-slow-1;dur=2.00;desc="SELECT * FROM product WHERE id IN (?)"' in debug
+    assert 'db-repeated-1;desc="3x SELECT * FROM product WHERE id IN (?)"' in debug
 
 @pytest.mark.asyncio 
 class TestGetProdByCat: 
@@ -76,9 +222,13 @@ class TestGetProdByCat:
     
     async def test_get_prod_valid(self, test_client: httpx.AsyncClient): 
         app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
-        await create_new_prod(test_client) 
-        res = await test_client.get('/products/shirt')
+        data, _ = await create_new_prod(test_client) 
+        await create_new_prod(test_client, cat=Cat.CAP)
+        res = await test_client.get('/products/shirt', params={'fields': 'id,cat', 'limit': 100})
         assert res.status_code == status.HTTP_200_OK
+        items = res.json()['items']
+        assert data['id'] in [item['id'] for item in items]
+        assert {item['cat'] for item in items} == {Cat.SHIRT.value}
 
 @pytest.mark.asyncio
 class TestGroupProdByCat: 
@@ -92,6 +242,9 @@ class TestGroupProdByCat:
         await create_new_prod(test_client, cat=Cat.SOCK, name='White sock')
         res = await test_client.get('/products/group_by_cat')
         assert res.status_code == status.HTTP_200_OK
+        groups = {group['category']: group['num_products'] for group in res.json()}
+        assert {Cat.SHIRT.value, Cat.PANT.value, Cat.MASK.value, Cat.CAP.value, Cat.SHOE.value, Cat.SOCK.value} <= set(groups)
+        assert all(count >= 1 for count in groups.values())
 
 @pytest.mark.asyncio 
 class TestUpdateProduct:
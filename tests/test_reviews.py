@@ -2,17 +2,22 @@ import pytest
 import pytest_asyncio
 import httpx
 from fastapi import status, HTTPException
-from .conftest import TestUser, Role
+from .conftest import TestUser, Role, async_session
 from ..main import app
 from ..db.db_conn import get_async_session
-from ..db.model import Review
+from ..db.model import Review, ReviewVote, User
+from ..db.categories import category_id
+from ..response_cache import response_cache
+from ..review_votes import UsefulCounter
+from sqlalchemy import select, update, func
 from ..routers.product import get_curr_user, Product, Cat
 from uuid import uuid4
+from datetime import datetime, timedelta
 
 
-async def create_new_prod(test_client: httpx.AsyncClient, cat: Cat = Cat.SHIRT, name: str = 'Black Hoodie') -> Product: 
+async def create_new_prod(test_client: httpx.AsyncClient, cat: Cat = Cat.SHIRT, name: str | None = None) -> Product: 
         new_prod = {
-            'name':name, 'price':9999, 'discount':5, 'thumbnail':'thumbnail.png', 'gallery':['gallery_img_1.png', 'gallery_img_2.png'], 'amt_left':10, 'cat':cat, 'description':'Beautiful Hoodie'
+            'name':name or f'Black Hoodie {uuid4().hex[:8]}', 'price':9999, 'discount':5, 'thumbnail':'thumbnail.png', 'gallery':['gallery_img_1.png', 'gallery_img_2.png'], 'amt_left':10, 'cat':cat, 'description':'Beautiful Hoodie'
         } 
         product = await test_client.post('/products/', json=new_prod) 
         assert product.status_code == status.HTTP_201_CREATED
@@ -24,6 +29,7 @@ async def create_new_prod(test_client: httpx.AsyncClient, cat: Cat = Cat.SHIRT,
 
 @pytest_asyncio.fixture(scope='module', autouse=True)
 async def create_test_product(test_client: httpx.AsyncClient): 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
     return (await create_new_prod(test_client))
 
     
@@ -65,16 +71,25 @@ class TestCreateReview:
 
 user_id = uuid4()
 
+async def purchase_prod(test_client: httpx.AsyncClient, product_id: int): 
+    payload = {
+        'total': 11498, 'shipping_fee': 1500, 'shipping_address': 'G50', 
+        'order_items': [{'total': 9998, 'quantity': 2, 'product_id': product_id, 'unit_price': 4999}], 
+    }
+    result = await test_client.post('/order/', json=payload)
+    assert result.status_code == status.HTTP_201_CREATED
+
+async def review_prod(test_client: httpx.AsyncClient, product_id: int, rating: float = 5.0) -> dict: 
+    await purchase_prod(test_client, product_id)
+    payload = {"content": "Tested and trusted", "rating": rating,  'product_id': product_id   }
+    result = await test_client.post('/review/', json=payload)  
+    assert result.status_code == status.HTTP_201_CREATED
+    return result.json()
+
 @pytest_asyncio.fixture(scope='module')
-async def create_test_review(test_client: httpx.AsyncClient, product: Product) -> Review: 
+async def create_test_review(test_client: httpx.AsyncClient, create_test_product) -> dict: 
     app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER, id=user_id).get_fake_user 
-    payload = {"content": "Tested and trusted", "rating": 5.0,  'product_id': product.id   }
-    result = await test_client.post('/reviews/', json=payload)  
-    assert result.status_code == status.HTTP_201_CREATED
-    review: Review | None = result.json() 
-    if not review: 
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
-    return review
+    return await review_prod(test_client, create_test_product['id'])
 
 
 class TestGetOneReview: 
@@ -141,4 +156,197 @@ class TestDeleteReview:
         app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER, user_id).get_fake_user
         result = await test_client.delete(f"{self.url}{review.id}")
         assert result.status_code == status.HTTP_204
-        
\ No newline at end of file
+        
+
+@pytest.mark.asyncio 
+async def test_reviews_by_unknown_product(test_client: httpx.AsyncClient): 
+    res = await test_client.get('/review/product/999999')
+    assert res.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.asyncio 
+async def test_reviews_by_product_hides_user_secrets(test_client: httpx.AsyncClient, create_test_product): 
+    res = await test_client.get(f"/review/product/{create_test_product['id']}")
+    assert res.status_code == status.HTTP_200_OK
+    for review in res.json()['items']: 
+        assert set(review['user']) == {'id', 'firstname', 'lastname', 'role'}
+
+@pytest.mark.asyncio 
+async def test_reviews_by_product_invalid_sort(test_client: httpx.AsyncClient, create_test_product): 
+    res = await test_client.get(f"/review/product/{create_test_product['id']}", params={'sort': 'oldest'})
+    assert res.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+@pytest.mark.asyncio 
+async def test_reviews_by_product_cursor_must_match_sort(test_client: httpx.AsyncClient, create_test_product): 
+    res = await test_client.get(f"/review/product/{create_test_product['id']}", params={'sort': 'most_useful', 'cursor': 'WyJub3QtYW4taW50IiwxXQ'})
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.asyncio 
+async def test_reviews_by_product_keyset_pages(test_client: httpx.AsyncClient): 
+    product_id, review_ids = await create_review_rows(6)
+    created = datetime(2026, 1, 1)
+    # every sort key has ties, so the id tie break decides part of each order
+    values = {
+        'created_at': [created, created + timedelta(hours=1), created, created + timedelta(hours=2), created + timedelta(hours=1), created],
+        'num_marked_useful': [2, 0, 2, 7, 0, 1],
+        'rating': [5.0, 4.0, 5.0, 3.0, 4.0, 5.0],
+    }
+    async with async_session() as session: 
+        for i, review_id in enumerate(review_ids): 
+            await session.execute(update(Review).where(Review.id == review_id).values({column: column_values[i] for column, column_values in values.items()}))
+        await session.commit()
+
+    for sort, column in (('newest', 'created_at'), ('most_useful', 'num_marked_useful'), ('highest_rating', 'rating')): 
+        expected = sorted(review_ids, key=lambda id: (values[column][review_ids.index(id)], id), reverse=True)
+        seen, cursor = [], None
+        while True: 
+            params = {'sort': sort, 'limit': 1} | ({'cursor': cursor} if cursor else {})
+            res = await test_client.get(f'/review/product/{product_id}', params=params)
+            assert res.status_code == status.HTTP_200_OK
+            items = res.json()['items']
+            assert len(items) <= 1
+            seen += [item['id'] for item in items]
+            cursor = res.json()['next_cursor']
+            if not cursor: 
+                break
+            assert len(seen) <= len(review_ids), f'{sort} pages never end'
+        # every review exactly once, in descending order with newer ids first on ties
+        assert seen == expected, sort
+
+@pytest.mark.asyncio 
+async def test_mark_unknown_review_useful(test_client: httpx.AsyncClient): 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
+    res = await test_client.post('/review/999999/useful')
+    assert res.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.asyncio 
+async def test_mark_review_useful_once(test_client: httpx.AsyncClient, create_test_review): 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
+    res = await test_client.post(f"/review/{create_test_review['id']}/useful")
+    assert res.status_code == status.HTTP_202_ACCEPTED
+    assert res.json()['num_marked_useful'] == create_test_review['num_marked_useful'] + 1
+    res = await test_client.post(f"/review/{create_test_review['id']}/useful")
+    assert res.status_code == status.HTTP_409_CONFLICT
+
+
+async def create_voters(count: int) -> list[User]: 
+    async with async_session() as session: 
+        users = [User(id=uuid4(), firstname='Muhammad', lastname='lastname', role=Role.CUSTOMER, email=f'{uuid4().hex}@iceedge.io', password='password1234') for _ in range(count)]
+        session.add_all(users)
+        await session.commit()
+    return users
+
+async def create_review_rows(count: int) -> tuple[int, list[int]]: 
+    author, = await create_voters(1)
+    async with async_session() as session: 
+        product = Product(name=f'Voted hoodie {uuid4().hex[:8]}', price=9999, discount=0, description='Voted', cat_id=category_id(Cat.SHIRT), thumbnail='t.png', gallery=[], amt_left=10)
+        session.add(product)
+        await session.flush()
+        reviews = [Review(content='Tested and trusted', rating=5.0, product_id=product.id, user_id=author.id) for _ in range(count)]
+        session.add_all(reviews)
+        await session.commit()
+        return product.id, [review.id for review in reviews]
+
+async def useful_counts(review_ids: list[int]) -> tuple[list[int], list[int]]: 
+    # the denormalized counter and the stored votes behind it
+    async with async_session() as session: 
+        counts = [await session.scalar(select(Review.num_marked_useful).where(Review.id == id)) for id in review_ids]
+        votes = [await session.scalar(select(func.count()).select_from(ReviewVote).where(ReviewVote.review_id == id)) for id in review_ids]
+    return counts, votes
+
+
+@pytest.mark.asyncio 
+class TestUsefulCounter: 
+    async def test_flush_counts_only_new_votes(self): 
+        counter = UsefulCounter(shards=1, session_maker=async_session)
+        product_id, (first, second) = await create_review_rows(2)
+        voters = await create_voters(3)
+        async with async_session() as session: 
+            # stored by an earlier flush, e.g. from another worker
+            session.add(ReviewVote(review_id=first, user_id=voters[0].id))
+            await session.execute(update(Review).where(Review.id == first).values(num_marked_useful=1))
+            await session.commit()
+        for voter in voters: 
+            assert counter.add(first, product_id, voter.id)
+        assert counter.add(second, product_id, voters[0].id)
+        assert not counter.add(second, product_id, voters[0].id)
+        assert counter.pending(first) == 3
+
+        await counter.flush_all()
+        assert counter.pending(first) == counter.pending(second) == 0
+        assert await useful_counts([first, second]) == ([3, 1], [3, 1])
+
+    async def test_flush_invalidates_product_listings(self): 
+        counter = UsefulCounter(shards=1, session_maker=async_session)
+        product_id, (review_id,) = await create_review_rows(1)
+        voter, = await create_voters(1)
+        response_cache.put(('listing',), b'[]', ('products',), response_cache.generation)
+        response_cache.put(('detail',), b'{}', (f'product:{product_id}',), response_cache.generation)
+        counter.add(review_id, product_id, voter.id)
+        await counter.flush_all()
+        assert response_cache.get(('listing',)) is None
+        assert response_cache.get(('detail',)) is None
+
+    async def test_failed_flush_keeps_votes(self): 
+        def unavailable(): 
+            raise RuntimeError('Database is unavailable')
+        counter = UsefulCounter(shards=1, session_maker=unavailable)
+        product_id, (review_id,) = await create_review_rows(1)
+        voters = await create_voters(2)
+        for voter in voters: 
+            counter.add(review_id, product_id, voter.id)
+        await counter.flush_all()
+        assert counter.pending(review_id) == 2
+        assert not counter.add(review_id, product_id, voters[0].id)
+
+        counter.session_maker = async_session
+        await counter.flush_all()
+        assert counter.pending(review_id) == 0
+        assert await useful_counts([review_id]) == ([2], [2])
+
+    async def test_stop_flushes_pending_votes(self): 
+        counter = UsefulCounter(flush_interval=60, session_maker=async_session)
+        product_id, (review_id,) = await create_review_rows(1)
+        voter, = await create_voters(1)
+        counter.start()
+        counter.add(review_id, product_id, voter.id)
+        await counter.stop()
+        assert await useful_counts([review_id]) == ([1], [1])
+
+
+async def product_rating(product_id: int) -> tuple[float, int]: 
+    async with async_session() as session: 
+        product = await session.get(Product, product_id)
+        return product.avg_rating, product.ratings_count
+
+@pytest.mark.asyncio 
+async def test_rating_aggregates_follow_reviews(test_client: httpx.AsyncClient): 
+    app.dependency_overrides[get_curr_user] = TestUser(Role.DEVELOPER).get_fake_user
+    product = await create_new_prod(test_client)
+    assert await product_rating(product['id']) == (0, 0)
+
+    first, second = TestUser(Role.CUSTOMER), TestUser(Role.CUSTOMER)
+    app.dependency_overrides[get_curr_user] = first.get_fake_user
+    first_review = await review_prod(test_client, product['id'], rating=4.0)
+    assert await product_rating(product['id']) == (4.0, 1)
+    app.dependency_overrides[get_curr_user] = second.get_fake_user
+    second_review = await review_prod(test_client, product['id'], rating=2.0)
+    assert await product_rating(product['id']) == (3.0, 2)
+
+    app.dependency_overrides[get_curr_user] = first.get_fake_user
+    res = await test_client.patch(f"/review/{first_review['id']}", json={'rating': 5.0})
+    assert res.status_code == status.HTTP_200_OK
+    assert await product_rating(product['id']) == (3.5, 2)
+    res = await test_client.patch(f"/review/{first_review['id']}", json={'content': 'Still great'})
+    assert res.status_code == status.HTTP_200_OK
+    assert await product_rating(product['id']) == (3.5, 2)
+
+    app.dependency_overrides[get_curr_user] = second.get_fake_user
+    res = await test_client.delete(f"/review/{second_review['id']}")
+    assert res.status_code == status.HTTP_204_NO_CONTENT
+    assert await product_rating(product['id']) == (5.0, 1)
+
+    # removing the last review brings the product back to unrated, not a division by zero
+    app.dependency_overrides[get_curr_user] = first.get_fake_user
+    res = await test_client.delete(f"/review/{first_review['id']}")
+    assert res.status_code == status.HTTP_204_NO_CONTENT
+    assert await product_rating(product['id']) == (0, 0)
@@ -1,13 +1,23 @@
+import asyncio
+import threading
 import pytest
 import pytest_asyncio
 import httpx
-from fastapi import status, HTTPException
-from .conftest import TestUser, Role
+from datetime import datetime, timedelta, timezone
+from fastapi import status, HTTPException, Response
+from .conftest import TestUser, Role, async_session, get_test_session
 from ..main import app
 from ..db.db_conn import get_async_session
-from ..db.model import User 
+from ..db.model import User, hash_token
 from ..db.schema import UserCreate, UserUpdate
 from ..routers.product import get_curr_user, Product, Cat
+from ..security import authenticate
+from ..security.authenticate import create_access_token
+from ..security import password
+from ..security.password import hash_password
+from ..dependencies import get_current_user_by_token
+from ..routers.user import logout
+from ..security.token_cache import token_cache, TokenCache, CachedUser
 from uuid import uuid4
 
 
@@ -68,4 +78,173 @@ class Me:
         app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
         result = await test_client.get(self.url)        
         assert result.status_code == status.HTTP_200_OK
-    
\ No newline at end of file
+    
+
+@pytest.mark.asyncio 
+async def test_register_then_login(test_client: httpx.AsyncClient): 
+    payload = {'firstname': 'Muhammad', 'lastname': 'lastname', 'email': 'register@iceedge.io', 'password': 'password1234', 'password_confirm': 'password1234', 'address': 'G50, Balogun Gambari'}
+    result = await test_client.post('/user/register', json=payload)
+    assert result.status_code == status.HTTP_200_OK
+    assert result.json()['email'] == payload['email']
+    assert 'password' not in result.json() and 'password_confirm' not in result.json()
+    result = await test_client.post('/user/register', json=payload)
+    assert result.status_code == status.HTTP_409_CONFLICT
+    result = await test_client.post('/user/login', data={'email': payload['email'], 'password': payload['password']})
+    assert result.status_code == status.HTTP_200_OK
+    assert result.cookies.get('token')
+
+
+@pytest.mark.asyncio 
+async def test_signin_returns_usable_token(test_client: httpx.AsyncClient): 
+    async with async_session() as session: 
+        session.add(User(id=uuid4(), firstname="Muhammad", lastname='lastname', role=Role.CUSTOMER, email='signin@iceedge.io', password=hash_password('password1234')))
+        await session.commit() 
+    result = await test_client.post('/user/token', data={'username': 'signin@iceedge.io', 'password': 'password1234'})
+    assert result.status_code == status.HTTP_200_OK
+    assert result.json()['token_type'] == 'bearer'
+    raw_token = result.json()['access_token']
+    # a fresh client, so no cookie from an earlier login in this module authenticates the request
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://localhost') as client: 
+        result = await client.get('/user/me', headers={'cookie': f'token={raw_token}'})
+        assert result.status_code == status.HTTP_200_OK
+        assert result.json()['email'] == 'signin@iceedge.io'
+        result = await client.get('/user/me', headers={'cookie': f'token={hash_token(raw_token)}'})
+        assert result.status_code == status.HTTP_401_UNAUTHORIZED
+    result = await test_client.post('/user/token', data={'username': 'signin@iceedge.io', 'password': 'wrong-password'})
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio 
+async def test_access_token_stored_as_hash(): 
+    async with async_session() as session: 
+        user = User(id=uuid4(), firstname="Muhammad", lastname='lastname', role=Role.CUSTOMER, email='token@iceedge.io', password='password1234')
+        session.add(user) 
+        await session.commit() 
+        raw_token, token = await create_access_token(user, session)
+        assert token.token_hash == hash_token(raw_token) != raw_token
+        assert (await get_current_user_by_token(raw_token, session)).id == user.id
+        with pytest.raises(HTTPException): 
+            await get_current_user_by_token(token.token_hash, session)
+
+
+@pytest.mark.asyncio 
+async def test_login_verifies_password_off_the_writer(test_client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch): 
+    async with async_session() as session: 
+        session.add(User(id=uuid4(), firstname="Muhammad", lastname='lastname', role=Role.CUSTOMER, email='writer@iceedge.io', password=hash_password('password1234')))
+        await session.commit() 
+    writers = []
+    async def get_writer_session(): 
+        async for session in get_test_session(): 
+            writers.append(session)
+            yield session
+    holding_writer = []
+    verify_password_async = authenticate.verify_password_async
+    async def verify(password: str, hashed_password: str) -> bool: 
+        holding_writer.append(any(session.in_transaction() for session in writers))
+        return await verify_password_async(password, hashed_password)
+    monkeypatch.setattr(authenticate, 'verify_password_async', verify)
+    app.dependency_overrides[get_async_session] = get_writer_session
+    try: 
+        result = await test_client.post('/user/login', data={'email': 'writer@iceedge.io', 'password': 'password1234'})
+    finally: 
+        app.dependency_overrides[get_async_session] = get_test_session
+    assert result.status_code == status.HTTP_200_OK
+    assert result.cookies.get('token')
+    assert holding_writer == [False]
+
+
+@pytest.mark.asyncio 
+class TestPasswordPool: 
+    async def test_full_pool_rejects_with_503(self, monkeypatch: pytest.MonkeyPatch): 
+        monkeypatch.setattr(password, 'PASSWORD_POOL_MAX_PENDING', 1)
+        release = threading.Event()
+        blocked = asyncio.create_task(password._run_in_pool(release.wait, 5))
+        await asyncio.sleep(0.05)
+        try: 
+            with pytest.raises(HTTPException) as e: 
+                await password.hash_password_async('password1234')
+            assert e.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+            assert e.value.headers == {'Retry-After': '1'}
+        finally: 
+            release.set()
+            await blocked
+        assert password._pending == 0
+        # the slot is free again once the blocking call returns
+        assert password.verify_password('password1234', await password.hash_password_async('password1234'))
+
+    async def test_login_returns_503_when_pool_is_full(self, test_client: httpx.AsyncClient, monkeypatch: pytest.MonkeyPatch): 
+        async with async_session() as session: 
+            session.add(User(id=uuid4(), firstname="Muhammad", lastname='lastname', role=Role.CUSTOMER, email='busy@iceedge.io', password=hash_password('password1234')))
+            await session.commit()
+        monkeypatch.setattr(password, 'PASSWORD_POOL_MAX_PENDING', 0)
+        result = await test_client.post('/user/login', data={'email': 'busy@iceedge.io', 'password': 'password1234'})
+        assert result.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert result.headers['retry-after'] == '1'
+        assert not result.cookies.get('token')
+
+    async def test_configure_rejects_unknown_kind(self): 
+        with pytest.raises(ValueError): 
+            password.configure_password_pool('fiber')
+
+
+async def create_token(role: Role = Role.CUSTOMER) -> tuple[User, str]: 
+    async with async_session() as session: 
+        user = User(id=uuid4(), firstname="Muhammad", lastname='lastname', role=role, email=f'{uuid4().hex}@iceedge.io', password='password1234')
+        session.add(user) 
+        await session.commit() 
+        raw_token, _ = await create_access_token(user, session)
+    return user, raw_token
+
+@pytest.mark.asyncio 
+class TestTokenCache: 
+    async def test_hit_skips_the_database(self): 
+        user, raw_token = await create_token()
+        async with async_session() as session: 
+            first = await get_current_user_by_token(raw_token, session)
+        hits = token_cache.hits
+        # a hit never touches the session, so none is needed
+        second = await get_current_user_by_token(raw_token, None)
+        assert token_cache.hits == hits + 1
+        assert second == first and second.id == user.id and second.role == Role.CUSTOMER
+        assert isinstance(second, CachedUser) and not isinstance(second, User)
+    
+    async def test_ttl_expiry(self): 
+        cache = TokenCache(ttl=0.05)
+        user = CachedUser(uuid4(), Role.CUSTOMER, 'ttl@iceedge.io', 'Muhammad', 'lastname', None, datetime.now())
+        cache.put('hash', user, datetime.now(tz=timezone.utc) + timedelta(days=1))
+        assert cache.get('hash') == user
+        await asyncio.sleep(0.06)
+        assert cache.get('hash') is None
+        # entries never outlive the token itself
+        cache.put('expired', user, datetime.now(tz=timezone.utc) - timedelta(seconds=1))
+        assert cache.get('expired') is None
+    
+    async def test_role_change_evicts(self, test_client: httpx.AsyncClient): 
+        user, raw_token = await create_token()
+        async with async_session() as session: 
+            assert (await get_current_user_by_token(raw_token, session)).role == Role.CUSTOMER
+        app.dependency_overrides[get_curr_user] = TestUser(Role.CUSTOMER).get_fake_user
+        result = await test_client.patch(f'/user/{user.id}/role', json={'role': Role.MERCHANT.value})
+        assert result.status_code == status.HTTP_403_FORBIDDEN
+        app.dependency_overrides[get_curr_user] = TestUser(Role.ADMIN).get_fake_user
+        result = await test_client.patch(f'/user/{user.id}/role', json={'role': Role.MERCHANT.value})
+        assert result.status_code == status.HTTP_200_OK
+        assert result.json()['role'] == Role.MERCHANT.value
+        assert token_cache.get(hash_token(raw_token)) is None
+        async with async_session() as session: 
+            assert (await get_current_user_by_token(raw_token, session)).role == Role.MERCHANT
+    
+    async def test_unknown_user_role(self, test_client: httpx.AsyncClient): 
+        app.dependency_overrides[get_curr_user] = TestUser(Role.ADMIN).get_fake_user
+        result = await test_client.patch(f'/user/{uuid4()}/role', json={'role': Role.MERCHANT.value})
+        assert result.status_code == status.HTTP_404_NOT_FOUND
+    
+    async def test_logout_evicts(self): 
+        _, raw_token = await create_token()
+        async with async_session() as session: 
+            await get_current_user_by_token(raw_token, session)
+            await logout(Response(), raw_token, session)
+        assert token_cache.get(hash_token(raw_token)) is None
+        async with async_session() as session: 
+            with pytest.raises(HTTPException): 
+                await get_current_user_by_token(raw_token, session)